@@ -0,0 +1,15 @@
+import shutil
+import tempfile
+
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def isolated_cache():
+    """Тесты под pytest не делят кэш с сервером, как и manage.py test."""
+    from core.test_runner import isolated_settings
+
+    directory = tempfile.mkdtemp(prefix='yatube_cache_')
+    with isolated_settings(directory):
+        yield
+    shutil.rmtree(directory, ignore_errors=True)
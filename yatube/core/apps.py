@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .invalidation import start_listener
+
+        # Слушатель шины сброса кэша запускается в каждом воркере
+        # при первом запросе, уже после fork
+        request_started.connect(
+            start_listener, dispatch_uid='core_invalidation_listener'
+        )
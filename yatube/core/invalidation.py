@@ -0,0 +1,240 @@
+"""
+Шина сброса кэша между узлами.
+
+Каждый узел держит свой кэш (см. core.mmap_cache), поэтому удаление
+ключа на одном узле нужно разослать остальным. purge() удаляет ключи
+локально и публикует их через транспорт из настройки INVALIDATION_BUS;
+слушатель на каждом узле удаляет полученные ключи из своего кэша.
+
+    INVALIDATION_BUS = {
+        'TRANSPORT': 'core.invalidation.UDPTransport',
+        'NODE': 'web-1',
+        'OPTIONS': {'bind': ('0.0.0.0', 9955), 'peers': [...]},
+    }
+
+Без настройки ключи удаляются только локально. Сообщения подписываются
+HMAC от SECRET_KEY: узел удаляет ключи только по сообщениям от узлов
+с тем же ключом, поэтому порт шины не дает посторонним сбрасывать кэш.
+"""
+import glob
+import hashlib
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Ключи рассылаются пачками, чтобы сообщение помещалось в одну датаграмму
+KEYS_PER_MESSAGE = 200
+MAX_MESSAGE = 65507
+SIGNATURE_SIZE = hashlib.sha256().digest_size * 2
+
+
+def _signature(body):
+    return hmac.new(
+        settings.SECRET_KEY.encode(), body, hashlib.sha256
+    ).hexdigest().encode()
+
+
+def sign(body):
+    return _signature(body) + body
+
+
+def unsign(payload):
+    """Тело сообщения, если подпись верна, иначе None."""
+    signature, body = payload[:SIGNATURE_SIZE], payload[SIGNATURE_SIZE:]
+    if hmac.compare_digest(signature, _signature(body)):
+        return body
+    return None
+
+
+class Transport:
+    """Доставляет сообщения шины всем узлам, кроме отправителя."""
+
+    def publish(self, payload):
+        raise NotImplementedError
+
+    def listen(self, handler):
+        """Блокирующий цикл приема, каждое сообщение передается в handler."""
+        raise NotImplementedError
+
+
+class UDPTransport(Transport):
+    """
+    Датаграммы UDP на список адресов узлов. Все воркеры узла слушают
+    один порт через SO_REUSEPORT, и ядро отдает сообщение одному из них:
+    кэш на узле общий, так что удалить ключ достаточно один раз.
+    """
+
+    def __init__(self, bind=('127.0.0.1', 9955), peers=()):
+        self.bind = tuple(bind)
+        self.peers = [tuple(peer) for peer in peers]
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def publish(self, payload):
+        for peer in self.peers:
+            try:
+                self.sender.sendto(payload, peer)
+            except OSError:
+                logger.warning('Узел %s недоступен для сброса кэша', peer)
+
+    def listen(self, handler):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        receiver.bind(self.bind)
+        while True:
+            handler(receiver.recv(MAX_MESSAGE))
+
+
+class UnixSocketTransport(Transport):
+    """
+    Датаграммные Unix-сокеты в общем каталоге: каждый процесс
+    слушает свой сокет, сообщение отправляется во все чужие.
+    Подходит, чтобы проверить шину на одной машине.
+    """
+
+    def __init__(self, directory, node):
+        self.directory = directory
+        self.prefix = f'{node}-'
+        self.path = os.path.join(directory, f'{node}-{os.getpid()}.sock')
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def publish(self, payload):
+        for path in glob.glob(os.path.join(self.directory, '*.sock')):
+            if os.path.basename(path).startswith(self.prefix):
+                continue
+            try:
+                self.sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Сокет остался от завершившегося процесса
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def listen(self, handler):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(self.path)
+        while True:
+            handler(receiver.recv(MAX_MESSAGE))
+
+
+class InvalidationBus:
+    def __init__(self, transport, node=None):
+        self.transport = transport
+        self.node = node or uuid4().hex
+        self.thread = None
+
+    def publish(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), KEYS_PER_MESSAGE):
+            self.transport.publish(sign(json.dumps({
+                'node': self.node,
+                'keys': keys[start:start + KEYS_PER_MESSAGE],
+            }).encode()))
+
+    def handle(self, payload):
+        # Исключение в слушателе остановило бы его поток до конца
+        # жизни процесса, и сброс с других узлов молча перестал бы
+        # доходить
+        try:
+            keys = self.parse(payload)
+        except Exception:
+            logger.exception('Не удалось разобрать сообщение шины кэша')
+            return
+        if keys:
+            try:
+                cache.delete_many(keys)
+            except Exception:
+                logger.exception('Не удалось сбросить ключи из шины кэша')
+
+    def parse(self, payload):
+        """Ключи из подписанного сообщения чужого узла или None."""
+        body = unsign(payload)
+        if body is None:
+            logger.warning('Сообщение шины кэша без верной подписи')
+            return None
+        message = json.loads(body)
+        if not isinstance(message, dict):
+            raise ValueError('Сообщение шины кэша — не объект')
+        keys = message.get('keys')
+        if not isinstance(keys, list) or not all(
+            isinstance(key, str) for key in keys
+        ):
+            raise ValueError('Ключи в сообщении шины кэша — не строки')
+        if message.get('node') == self.node:
+            return None
+        return keys
+
+    def start(self):
+        """Запускает слушателя в фоновом потоке, один раз на процесс."""
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.transport.listen,
+                args=(self.handle,),
+                name='cache-invalidation',
+                daemon=True
+            )
+            self.thread.start()
+
+
+_bus = None
+_bus_pid = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    """Шина процесса по настройке INVALIDATION_BUS или None."""
+    global _bus, _bus_pid
+    config = getattr(settings, 'INVALIDATION_BUS', None)
+    if not config:
+        return None
+    with _bus_lock:
+        if _bus is None or _bus_pid != os.getpid():
+            node = config.get('NODE') or socket.gethostname()
+            options = dict(config.get('OPTIONS', {}))
+            transport_class = import_string(config['TRANSPORT'])
+            if transport_class is UnixSocketTransport:
+                options.setdefault('node', node)
+            _bus = InvalidationBus(transport_class(**options), node)
+            _bus_pid = os.getpid()
+        return _bus
+
+
+def start_listener(**kwargs):
+    bus = get_bus()
+    if bus is not None:
+        bus.start()
+
+
+def purge(keys):
+    """
+    Удаляет ключи из локального кэша сразу и еще раз после фиксации
+    транзакции: запрос, прочитавший незафиксированные данные, мог
+    успеть снова положить их в кэш. Другим узлам ключи рассылаются
+    тоже после фиксации.
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    cache.delete_many(keys)
+    bus = get_bus()
+
+    def committed():
+        cache.delete_many(keys)
+        if bus is not None:
+            bus.publish(keys)
+
+    transaction.on_commit(committed)
@@ -0,0 +1,420 @@
+"""
+Кэш в общем файле, отображенном в память (mmap).
+
+Все процессы gunicorn на одной машине открывают один и тот же файл,
+поэтому запись или сброс в одном воркере сразу видны остальным.
+
+Файл устроен как несколько множественно-ассоциативных таблиц, по одной
+на класс размера ячеек: мелкие значения (поколения, токены тегов,
+блокировки) не занимают ячейку, рассчитанную на целую страницу.
+В каждом классе ключ по хэшу попадает в один набор из WAYS ячеек,
+а значение пишется в самый мелкий класс, куда оно помещается.
+Внутри набора вытесняется давно не использованная ячейка (LRU).
+Каждый набор защищен своей блокировкой fcntl на диапазон байтов;
+операция с ключом берет блокировки его наборов во всех классах,
+так что процессы блокируют друг друга только при работе с одними
+наборами, а у ключа не бывает двух живых копий.
+
+Значения читаются через pickle, поэтому файл должен быть доступен
+только владельцу процесса: каталог из LOCATION создается с правами
+0o700, а чужой каталог или файл не открывается.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+MAGIC = b'YTMC'
+FORMAT_VERSION = 2
+# Магия, версия, WAYS и хэш размеров классов
+HEADER = struct.Struct('=4sII8s')
+HEADER_SIZE = 64
+# Заголовок ячейки: хэш ключа, срок жизни (0 — бессрочно),
+# время последнего обращения, токен для cas, длины ключа и значения.
+SLOT = struct.Struct('=QdQQHI')
+THREAD_LOCKS = 64
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def _check_private(info, path):
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise ImproperlyConfigured(
+            f'{path} должен принадлежать пользователю процесса '
+            f'и быть закрыт для остальных'
+        )
+
+
+def _open_private(path):
+    """
+    Открывает файл кэша в приватном каталоге. Другой пользователь
+    не может ни подложить свой файл, ни прочитать чужие значения.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    _check_private(os.stat(directory), directory)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        _check_private(os.fstat(fd), path)
+    except ImproperlyConfigured:
+        os.close(fd)
+        raise
+    return fd
+
+
+class _SharedFile:
+    """
+    Открытый файл кэша, один на процесс и путь. classes — пары
+    (байт на ячейку, число наборов) по возрастанию размера ячеек.
+    """
+
+    def __init__(self, path, ways, classes):
+        self.ways = ways
+        self.classes = classes
+        self.layout = hashlib.blake2b(
+            repr(classes).encode(), digest_size=8
+        ).digest()
+        # Начало каждого класса в файле и номер его первого набора
+        self.regions = []
+        offset, first_set = HEADER_SIZE, 0
+        for slot_size, sets in classes:
+            self.regions.append((offset, first_set))
+            offset += sets * ways * slot_size
+            first_set += sets
+        self.size = offset
+        # Блокировки fcntl принадлежат процессу целиком, поэтому потоки
+        # одного процесса дополнительно разводятся обычными блокировками.
+        self.thread_locks = [threading.Lock() for _ in range(THREAD_LOCKS)]
+        self.fd = _open_private(path)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            if not self._header_matches():
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, self._header(), 0)
+            self.map = mmap.mmap(self.fd, self.size)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def _header(self):
+        return HEADER.pack(MAGIC, FORMAT_VERSION, self.ways, self.layout)
+
+    def _header_matches(self):
+        if os.fstat(self.fd).st_size != self.size:
+            return False
+        return os.pread(self.fd, HEADER.size, 0) == self._header()
+
+    def slot_size(self, slot_class):
+        return self.classes[slot_class][0]
+
+    def set_offset(self, slot_class, index):
+        return (
+            self.regions[slot_class][0]
+            + index * self.ways * self.slot_size(slot_class)
+        )
+
+    def lock(self, sets):
+        """Блокировка наборов [(класс, номер набора), ...]."""
+        return _SetLock(self, sets)
+
+
+class _SetLock:
+    def __init__(self, shared, sets):
+        self.shared = shared
+        # Все процессы и потоки берут блокировки в одном порядке
+        self.ranges = sorted(
+            (shared.set_offset(slot_class, index),
+             shared.ways * shared.slot_size(slot_class))
+            for slot_class, index in sets
+        )
+        self.thread_locks = [
+            shared.thread_locks[number] for number in sorted({
+                (shared.regions[slot_class][1] + index) % THREAD_LOCKS
+                for slot_class, index in sets
+            })
+        ]
+
+    def __enter__(self):
+        for thread_lock in self.thread_locks:
+            thread_lock.acquire()
+        for start, length in self.ranges:
+            fcntl.lockf(self.shared.fd, fcntl.LOCK_EX, length, start)
+
+    def __exit__(self, *exc_info):
+        for start, length in reversed(self.ranges):
+            fcntl.lockf(self.shared.fd, fcntl.LOCK_UN, length, start)
+        for thread_lock in reversed(self.thread_locks):
+            thread_lock.release()
+
+
+def _open(path, ways, classes):
+    # После fork дочерний процесс открывает файл заново
+    key = (path, os.getpid(), ways, classes)
+    with _files_lock:
+        shared = _files.get(key)
+        if shared is None:
+            shared = _files[key] = _SharedFile(path, ways, classes)
+        return shared
+
+
+class MmapCache(BaseCache):
+    """
+    Бэкенд кэша Django поверх общего mmap-файла.
+
+    LOCATION — абсолютный путь к файлу в каталоге, который принадлежит
+    только приложению. OPTIONS: SLOT_CLASSES ({байт на ячейку: число
+    ячеек}), WAYS (ячеек в наборе). Вместо SLOT_CLASSES можно задать
+    один класс через SLOT_SIZE и MAX_ENTRIES. Значения, которые
+    не помещаются и в самую крупную ячейку, не кэшируются.
+    Помимо обычного API есть gets()/cas() для атомарной замены значения.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        if not location or not os.path.isabs(location):
+            raise ImproperlyConfigured(
+                'MmapCache требует абсолютный путь к файлу в LOCATION'
+            )
+        self.path = location
+        self.ways = int(options.get('WAYS', 8))
+        slot_classes = options.get('SLOT_CLASSES') or {
+            int(options.get('SLOT_SIZE', 64 * 1024)): self._max_entries
+        }
+        self.classes = tuple(sorted(
+            (int(slot_size), max(1, math.ceil(int(entries) / self.ways)))
+            for slot_size, entries in slot_classes.items()
+        ))
+
+    @property
+    def _shared(self):
+        return _open(self.path, self.ways, self.classes)
+
+    def _locate(self, key, version):
+        """Ключ, его хэш и наборы ключа во всех классах."""
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        raw = key.encode()
+        digest = int.from_bytes(
+            hashlib.blake2b(raw, digest_size=8).digest(), 'little'
+        )
+        sets = [
+            (slot_class, digest % sets)
+            for slot_class, (_, sets) in enumerate(self.classes)
+        ]
+        return raw, digest, sets
+
+    def _slot(self, shared, slot_class, index, way):
+        offset = (
+            shared.set_offset(slot_class, index)
+            + way * shared.slot_size(slot_class)
+        )
+        return offset, SLOT.unpack_from(shared.map, offset)
+
+    def _find(self, shared, sets, raw, digest):
+        """
+        Живая ячейка с ключом в любом из наборов: (смещение, заголовок,
+        класс) или None. Истекшая ячейка по пути освобождается.
+        """
+        for slot_class, index in sets:
+            for way in range(shared.ways):
+                offset, header = self._slot(shared, slot_class, index, way)
+                key_hash, expires, _, _, key_len, _ = header
+                if key_len != len(raw) or key_hash != digest:
+                    continue
+                start = offset + SLOT.size
+                if shared.map[start:start + key_len] != raw:
+                    continue
+                if expires and expires <= time.time():
+                    self._free(shared, offset)
+                    return None
+                return offset, header, slot_class
+        return None
+
+    def _free(self, shared, offset):
+        shared.map[offset:offset + SLOT.size] = bytes(SLOT.size)
+
+    def _victim(self, shared, slot_class, index):
+        """Свободная или самая давно использованная ячейка набора."""
+        now = time.time()
+        oldest = None
+        for way in range(shared.ways):
+            offset, header = self._slot(shared, slot_class, index, way)
+            _, expires, last_used, _, key_len, _ = header
+            if not key_len or (expires and expires <= now):
+                return offset
+            if oldest is None or last_used < oldest[1]:
+                oldest = (offset, last_used)
+        return oldest[0]
+
+    def _read(self, shared, found):
+        offset, header, _ = found
+        _, expires, _, token, key_len, value_len = header
+        shared.map[offset:offset + SLOT.size] = SLOT.pack(
+            header[0], expires, time.monotonic_ns(), token, key_len,
+            value_len
+        )
+        start = offset + SLOT.size + key_len
+        return bytes(shared.map[start:start + value_len]), token
+
+    def _write(self, shared, offset, raw, digest, data, timeout,
+               previous_token=0):
+        expires = self.get_backend_timeout(timeout) or 0.0
+        token = max(previous_token + 1, time.time_ns())
+        shared.map[offset:offset + SLOT.size] = SLOT.pack(
+            digest, expires, time.monotonic_ns(), token, len(raw), len(data)
+        )
+        start = offset + SLOT.size
+        shared.map[start:start + len(raw)] = raw
+        shared.map[start + len(raw):start + len(raw) + len(data)] = data
+        return token
+
+    def _slot_class(self, raw, data):
+        """Самый мелкий класс, в ячейку которого помещается значение."""
+        needed = SLOT.size + len(raw) + len(data)
+        for slot_class, (slot_size, _) in enumerate(self.classes):
+            if needed <= slot_size:
+                return slot_class
+        return None
+
+    def _store(self, key, value, timeout, version, only_new=False,
+               expected_token=None):
+        raw, digest, sets = self._locate(key, version)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        shared = self._shared
+        with shared.lock(sets):
+            found = self._find(shared, sets, raw, digest)
+            if only_new and found is not None:
+                return False
+            if expected_token is not None and (
+                found is None or found[1][3] != expected_token
+            ):
+                return False
+            return self._put(shared, sets, found, raw, digest, data, timeout)
+
+    def _put(self, shared, sets, found, raw, digest, data, timeout):
+        """Пишет значение под уже взятой блокировкой наборов ключа."""
+        slot_class = self._slot_class(raw, data)
+        if slot_class is None:
+            # Слишком большое значение не кэшируем, но и старое
+            # не оставляем, чтобы не отдавать устаревшие данные
+            if found is not None:
+                self._free(shared, found[0])
+            return False
+        previous = 0
+        if found is not None:
+            offset, header, found_class = found
+            previous = header[3]
+            if found_class != slot_class:
+                # Значение сменило класс: старая ячейка освобождается
+                self._free(shared, offset)
+                found = None
+        if found is None:
+            offset = self._victim(shared, *sets[slot_class])
+        self._write(shared, offset, raw, digest, data, timeout, previous)
+        return True
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, value, timeout, version, only_new=True)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return [
+            key for key, value in data.items()
+            if not self._store(key, value, timeout, version)
+        ]
+
+    def gets(self, key, default=None, version=None):
+        """Значение и токен для последующего cas()."""
+        raw, digest, sets = self._locate(key, version)
+        shared = self._shared
+        with shared.lock(sets):
+            found = self._find(shared, sets, raw, digest)
+            if found is None:
+                return default, None
+            data, token = self._read(shared, found)
+        return pickle.loads(data), token
+
+    def cas(self, key, value, token, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Записывает значение, только если с момента gets() ключ
+        никто не менял. Токен None после промаха значит, что ключа
+        все еще не должно быть. Возвращает True при успешной записи.
+        """
+        if token is None:
+            return self._store(key, value, timeout, version, only_new=True)
+        return self._store(
+            key, value, timeout, version, expected_token=token
+        )
+
+    def get(self, key, default=None, version=None):
+        return self.gets(key, default, version)[0]
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        raw, digest, sets = self._locate(key, version)
+        shared = self._shared
+        with shared.lock(sets):
+            found = self._find(shared, sets, raw, digest)
+            if found is None:
+                return False
+            offset, header, _ = found
+            expires = self.get_backend_timeout(timeout) or 0.0
+            shared.map[offset:offset + SLOT.size] = SLOT.pack(
+                header[0], expires, *header[2:]
+            )
+            return True
+
+    def delete(self, key, version=None):
+        raw, digest, sets = self._locate(key, version)
+        shared = self._shared
+        with shared.lock(sets):
+            found = self._find(shared, sets, raw, digest)
+            if found is None:
+                return False
+            self._free(shared, found[0])
+            return True
+
+    def has_key(self, key, version=None):
+        sentinel = object()
+        return self.get(key, sentinel, version) is not sentinel
+
+    def incr(self, key, delta=1, version=None):
+        raw, digest, sets = self._locate(key, version)
+        shared = self._shared
+        with shared.lock(sets):
+            found = self._find(shared, sets, raw, digest)
+            if found is None:
+                raise ValueError("Key '%s' not found" % key)
+            data, _ = self._read(shared, found)
+            value = pickle.loads(data) + delta
+            expires = found[1][1]
+            timeout = expires - time.time() if expires else None
+            self._put(
+                shared, sets, found, raw, digest,
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL), timeout
+            )
+            return value
+
+    def clear(self):
+        shared = self._shared
+        empty = bytes(SLOT.size)
+        for slot_class, (slot_size, sets) in enumerate(shared.classes):
+            for index in range(sets):
+                with shared.lock([(slot_class, index)]):
+                    for way in range(shared.ways):
+                        offset = (
+                            shared.set_offset(slot_class, index)
+                            + way * slot_size
+                        )
+                        shared.map[offset:offset + SLOT.size] = empty
@@ -0,0 +1,144 @@
+"""
+Кэш целых страниц для анонимных читателей с сбросом по тегам.
+
+Представление помечает ответ тегами (surrogate keys), например
+post:42, group:3, author:7. У каждого тега в кэше лежит случайный
+токен; страница сохраняется вместе с токенами своих тегов и отдается,
+только пока все они на месте. purge_tags() удаляет токены через шину
+сброса кэша, поэтому одна операция сбрасывает все страницы с тегом
+на всех узлах.
+
+Middleware стоит до SessionMiddleware: попадание в кэш не трогает
+сессию, CSRF, шаблоны и базу. Страницу, у которой вышел срок, пересчитывает
+один запрос, остальные тем временем получают прежний вариант
+(core.stampede). Сброшенная по тегу страница прежним вариантом
+не отдается.
+"""
+import hashlib
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from . import stampede
+from .invalidation import purge
+
+HEADER = 'Surrogate-Key'
+# Заголовки, которые сохраняются вместе с телом страницы
+STORED_HEADERS = ('Content-Type', 'ETag', 'X-Frame-Options', HEADER)
+
+
+def tag_key(tag):
+    return f'surrogate:{tag}'
+
+
+def tag(response, *tags):
+    """Помечает ответ тегами; без тегов страница не кэшируется."""
+    tags = [str(value) for value in tags if value is not None]
+    response.surrogate_keys = tags
+    response[HEADER] = ' '.join(tags)
+    return response
+
+
+def tag_keys(*tags):
+    return [tag_key(value) for value in tags]
+
+
+def purge_tags(*tags):
+    purge(tag_keys(*tags))
+
+
+def _tokens(tags):
+    """Токены тегов, недостающие заводятся через add()."""
+    keys = tag_keys(*tags)
+    tokens = cache.get_many(keys)
+    missing = [key for key in keys if key not in tokens]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid4().hex, None)
+        tokens.update(cache.get_many(missing))
+    return tokens
+
+
+class AnonymousPageCacheMiddleware:
+    """
+    Отдает анонимным GET-запросам сохраненные страницы. Анонимным
+    считается запрос без куки сессии: ее не нужно загружать из базы.
+    PAGE_CACHE_TIMEOUT = 0 выключает кэш.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def cacheable_request(self, request):
+        return (
+            request.method in ('GET', 'HEAD')
+            and settings.PAGE_CACHE_TIMEOUT
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        )
+
+    def cache_key(self, request):
+        path = f'{request.get_host()}{request.get_full_path()}'.encode()
+        return f'page:{hashlib.md5(path).hexdigest()}'
+
+    def __call__(self, request):
+        if not self.cacheable_request(request):
+            return self.get_response(request)
+        key = self.cache_key(request)
+        entry = cache.get(key)
+        if entry is not None and not self.tokens_match(entry):
+            # Страница сброшена по тегу: это промах, а не устаревание
+            entry = None
+        if entry is not None and stampede.is_fresh(entry[3], entry[4]):
+            return self.cached_response(request, entry)
+        if not stampede.acquire(key):
+            if entry is not None:
+                return self.cached_response(request, entry)
+            return self.get_response(request)
+        try:
+            started = time.monotonic()
+            response = self.get_response(request)
+            self.store(key, response, time.monotonic() - started)
+        finally:
+            stampede.release(key)
+        return response
+
+    def tokens_match(self, entry):
+        tokens = entry[0]
+        return cache.get_many(list(tokens)) == tokens
+
+    def cached_response(self, request, entry):
+        _, content, headers, _, _ = entry
+        response = HttpResponse(content)
+        for name, value in headers.items():
+            response[name] = value
+        return get_conditional_response(
+            request, etag=response.get('ETag'), response=response
+        )
+
+    def store(self, key, response, delta):
+        tags = getattr(response, 'surrogate_keys', None)
+        if (
+            not tags
+            or response.status_code != 200
+            or response.streaming
+            or response.cookies
+        ):
+            # Например, 404 только что удаленного поста: прежняя
+            # страница не должна остаться в кэше
+            cache.delete(key)
+            return
+        headers = {
+            name: response[name]
+            for name in STORED_HEADERS if response.has_header(name)
+        }
+        timeout = settings.PAGE_CACHE_TIMEOUT
+        cache.set(
+            key,
+            (_tokens(tags), response.content, headers,
+             stampede.expiry(timeout), delta),
+            stampede.store_timeout(timeout)
+        )
@@ -0,0 +1,87 @@
+"""
+Защита кэша от одновременного пересчета (cache stampede).
+
+Значение хранится вместе с мягким сроком жизни и временем пересчета.
+Срок хранения в кэше на STALE_TIMEOUT больше мягкого, и все это время
+устаревшее значение можно отдавать, пока его пересчитывает один
+процесс: право на пересчет дается через cache.add() ключа блокировки.
+Устаревшим считается только значение с вышедшим сроком: сброс
+(другая версия) — это промах. При промахе запрос считает значение
+сам и не ждет чужого пересчета, чтобы не держать поток.
+Горячий ключ пересчитывается немного раньше срока с вероятностью,
+растущей к его концу (XFetch), поэтому обычно до промаха не доходит.
+"""
+import math
+import random
+import time
+
+from django.core.cache import cache
+
+LOCK_TIMEOUT = 10
+STALE_TIMEOUT = 60
+# Чем больше BETA, тем раньше начинается досрочный пересчет
+BETA = 1.0
+
+
+def lock_key(key):
+    return f'{key}:lock'
+
+
+def acquire(key):
+    """Право пересчитать ключ; его получает ровно один процесс."""
+    return cache.add(lock_key(key), 1, LOCK_TIMEOUT)
+
+
+def release(key):
+    cache.delete(lock_key(key))
+
+
+def expiry(timeout):
+    return None if timeout is None else time.time() + timeout
+
+
+def store_timeout(timeout):
+    return None if timeout is None else timeout + STALE_TIMEOUT
+
+
+def is_fresh(expires, delta, beta=BETA):
+    """
+    Мягкий срок еще не вышел. Чем дольше пересчет (delta) и ближе
+    срок, тем вероятнее ответ «пора обновить» до его наступления.
+    """
+    if expires is None:
+        return True
+    gap = -delta * beta * math.log(1 - random.random())
+    return time.time() + gap < expires
+
+
+def _recompute(key, compute, timeout, version):
+    started = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - started
+    cache.set(
+        key, (version, value, expiry(timeout), delta),
+        store_timeout(timeout)
+    )
+    return value
+
+
+def fetch(key, compute, timeout, version=None):
+    """
+    Значение ключа или результат compute(). Значение с другой версией
+    (например, поколением ленты) сброшено и не отдается.
+    """
+    entry = cache.get(key)
+    if entry is not None and entry[0] != version:
+        entry = None
+    if entry is not None and is_fresh(entry[2], entry[3]):
+        return entry[1]
+    if acquire(key):
+        try:
+            return _recompute(key, compute, timeout, version)
+        finally:
+            release(key)
+    if entry is not None:
+        # Пересчитывает другой процесс, пока отдаем прежнее значение
+        return entry[1]
+    return _recompute(key, compute, timeout, version)
@@ -0,0 +1,65 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from ..stampede import fetch
+
+register = template.Library()
+
+
+class SWRCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, fragment_name, vary_on, version):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+        self.version = version
+
+    def render(self, context):
+        timeout = self.timeout.resolve(context)
+        if timeout is not None:
+            try:
+                timeout = int(timeout)
+            except (ValueError, TypeError):
+                raise template.TemplateSyntaxError(
+                    f'"swr_cache" tag got a non-integer timeout value: '
+                    f'{timeout!r}'
+                )
+        key = make_template_fragment_key(
+            self.fragment_name,
+            [var.resolve(context) for var in self.vary_on]
+        )
+        version = self.version and self.version.resolve(context)
+        return fetch(
+            key, lambda: self.nodelist.render(context), timeout, version
+        )
+
+
+@register.tag('swr_cache')
+def do_swr_cache(parser, token):
+    """
+    Как {% cache %}, но пересчет фрагмента достается одному процессу,
+    а остальные до его окончания получают прежний вариант:
+
+        {% swr_cache timeout name [vary_on ...] [version=expr] %}
+
+    Прежний вариант отдается только после истечения срока. Смена
+    version (например, поколения ленты) означает сброс: фрагмент
+    с другой версией не отдается и сразу строится заново.
+    """
+    nodelist = parser.parse(('endswr_cache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(
+            f"'{tokens[0]}' tag requires at least 2 arguments."
+        )
+    version = None
+    if tokens[-1].startswith('version='):
+        version = parser.compile_filter(tokens.pop()[len('version='):])
+    return SWRCacheNode(
+        nodelist,
+        parser.compile_filter(tokens[1]),
+        tokens[2],
+        [parser.compile_filter(token) for token in tokens[3:]],
+        version,
+    )
@@ -0,0 +1,95 @@
+"""
+Запуск тестов, в котором каждый тест начинается с пустым кэшем.
+
+Тесты не делят кэш с запущенным сервером: файлы mmap-кэша
+(core.mmap_cache) лежат во временном каталоге прогона, у каждого
+процесса --parallel свои. Между тестами база откатывается, и id постов
+повторяются, а страницы, фрагменты и токены тегов в кэше остались бы
+от прошлого теста, поэтому кэш очищается перед каждым тестом.
+Миниатюры в тестах строятся сразу: пул процессов не видит тестовую
+базу в памяти.
+"""
+import os
+import shutil
+import tempfile
+from unittest import TextTestResult
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test import runner
+from django.test.runner import (
+    DiscoverRunner, ParallelTestSuite, RemoteTestResult, RemoteTestRunner
+)
+from django.test.utils import override_settings
+
+MMAP_BACKEND = 'core.mmap_cache.MmapCache'
+
+
+def isolated_settings(directory, suffix=''):
+    """
+    override_settings, который переносит файлы mmap-кэшей в directory
+    и выключает пул миниатюр.
+    """
+    return override_settings(
+        CACHES={
+            alias: (
+                dict(config, LOCATION=os.path.join(directory, alias + suffix))
+                if config['BACKEND'] == MMAP_BACKEND else config
+            )
+            for alias, config in settings.CACHES.items()
+        },
+        THUMBNAIL_WORKERS=0,
+    )
+
+
+class ClearCachesMixin:
+    def startTest(self, test):
+        for cache in caches.all():
+            cache.clear()
+        super().startTest(test)
+
+
+class RemoteResult(ClearCachesMixin, RemoteTestResult):
+    pass
+
+
+class RemoteRunner(RemoteTestRunner):
+    resultclass = RemoteResult
+
+
+def _init_worker(counter):
+    # Процессы --parallel очищают кэш перед своими тестами и не должны
+    # стирать его у соседей
+    runner._init_worker(counter)
+    isolated_settings(
+        ParallelSuite.cache_directory, f'-{runner._worker_id}'
+    ).enable()
+
+
+class ParallelSuite(ParallelTestSuite):
+    init_worker = _init_worker
+    runner_class = RemoteRunner
+    cache_directory = None
+
+
+class CacheIsolatingRunner(DiscoverRunner):
+    parallel_test_suite = ParallelSuite
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_directory = tempfile.mkdtemp(prefix='yatube_cache_')
+        ParallelSuite.cache_directory = self.cache_directory
+        self.isolated_settings = isolated_settings(self.cache_directory)
+        self.isolated_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolated_settings.disable()
+        shutil.rmtree(self.cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
+
+    def get_resultclass(self):
+        resultclass = super().get_resultclass() or TextTestResult
+        return type(
+            f'CacheIsolating{resultclass.__name__}',
+            (ClearCachesMixin, resultclass), {}
+        )
@@ -1,7 +1,24 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
 from http import HTTPStatus
+from unittest import mock
 
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.template import Context, Template
 from django.test import Client, TestCase
 
+from . import stampede
+from .invalidation import (
+    InvalidationBus, UDPTransport, UnixSocketTransport, purge, sign
+)
+from .mmap_cache import MmapCache
+
 
 class Pages404and403Test(TestCase):
     def setUp(self):
@@ -14,3 +31,318 @@ class Pages404and403Test(TestCase):
         response = self.client.get('/page_not_exists')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class MmapCacheTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        options.setdefault('MAX_ENTRIES', 16)
+        options.setdefault('WAYS', 4)
+        options.setdefault('SLOT_SIZE', 1024)
+        return MmapCache(
+            os.path.join(self.directory, 'cache'), {'OPTIONS': options}
+        )
+
+    def test_basic_operations(self):
+        """Core: mmap-кэш поддерживает основной API кэша Django."""
+        cache = self.cache
+        cache.set('key', {'value': 1})
+        self.assertEqual(cache.get('key'), {'value': 1})
+        self.assertFalse(cache.add('key', 'other'))
+        self.assertTrue(cache.add('new', 'value'))
+        cache.set('counter', 1)
+        self.assertEqual(cache.incr('counter'), 2)
+        self.assertEqual(cache.get_many(['key', 'new', 'missing']), {
+            'key': {'value': 1}, 'new': 'value'
+        })
+        self.assertTrue(cache.delete('key'))
+        self.assertIsNone(cache.get('key'))
+        cache.clear()
+        self.assertIsNone(cache.get('new'))
+
+    def test_timeout(self):
+        """Core: Записи mmap-кэша истекают по TTL."""
+        self.cache.set('short', 'value', 0.05)
+        self.cache.set('forever', 'value', None)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('short'))
+        self.assertEqual(self.cache.get('forever'), 'value')
+
+    def test_lru_eviction(self):
+        """Core: Из переполненного набора вытесняется давний ключ."""
+        cache = self.make_cache(MAX_ENTRIES=4, WAYS=4)
+        for i in range(4):
+            cache.set(f'key{i}', i)
+        cache.get('key0')
+        cache.set('key4', 4)
+        self.assertEqual(cache.get('key0'), 0)
+        self.assertIsNone(cache.get('key1'))
+        self.assertEqual(cache.get('key4'), 4)
+
+    def test_cas(self):
+        """Core: cas() не перезаписывает ключ, измененный после gets()."""
+        self.cache.set('key', 1)
+        value, token = self.cache.gets('key')
+        self.assertTrue(self.cache.cas('key', value + 1, token))
+        self.assertFalse(self.cache.cas('key', value + 2, token))
+        self.assertEqual(self.cache.get('key'), 2)
+
+    def test_cas_after_miss(self):
+        """
+        Core: cas() после промаха не перетирает ключ, который
+        успел записать другой процесс.
+        """
+        value, token = self.cache.gets('missing')
+        self.assertIsNone(token)
+        self.cache.set('missing', 'other')
+        self.assertFalse(self.cache.cas('missing', 'mine', token))
+        self.assertEqual(self.cache.get('missing'), 'other')
+        self.cache.delete('missing')
+        self.assertTrue(self.cache.cas('missing', 'mine', token))
+
+    def test_too_large_value_is_not_cached(self):
+        """Core: Значение больше ячейки не кэшируется."""
+        self.cache.set('key', 'small')
+        self.assertEqual(self.cache.set_many({'key': 'x' * 2048}), ['key'])
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_slot_classes(self):
+        """
+        Core: Мелкие значения не вытесняют крупные из своих ячеек,
+        а значение, сменившее размер, хранится в одной копии.
+        """
+        cache = self.make_cache(SLOT_CLASSES={256: 4, 4096: 4})
+        cache.set('page', 'x' * 2048)
+        for i in range(16):
+            cache.set(f'small{i}', i)
+        self.assertEqual(cache.get('page'), 'x' * 2048)
+
+        cache.set('page', 'short')
+        self.assertEqual(cache.get('page'), 'short')
+        self.assertTrue(cache.delete('page'))
+        self.assertIsNone(cache.get('page'))
+        cache.set('small15', 'y' * 2048)
+        self.assertEqual(cache.incr('small14'), 15)
+        self.assertEqual(cache.get('small15'), 'y' * 2048)
+        cache.set('small15', 'z' * 8192)
+        self.assertIsNone(cache.get('small15'))
+
+    def test_shared_between_processes(self):
+        """Core: Запись из другого процесса видна через общий файл."""
+        self.cache.set('key', 'parent')
+        process = multiprocessing.get_context('fork').Process(
+            target=_child_write, args=(self.make_cache(),)
+        )
+        process.start()
+        process.join()
+        self.assertEqual(self.cache.get('key'), 'child')
+
+    def test_location_must_be_private(self):
+        """
+        Core: mmap-кэш не открывает файл без явного пути и в каталоге,
+        доступном другим пользователям.
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            MmapCache('', {})
+        shared = os.path.join(self.directory, 'shared')
+        os.mkdir(shared)
+        os.chmod(shared, 0o777)
+        cache = MmapCache(os.path.join(shared, 'cache'), {})
+        with self.assertRaises(ImproperlyConfigured):
+            cache.set('key', 'value')
+        private = os.path.join(self.directory, 'private', 'cache')
+        MmapCache(private, {}).set('key', 'value')
+        self.assertEqual(
+            os.stat(os.path.dirname(private)).st_mode & 0o777, 0o700
+        )
+
+
+def _child_write(cache):
+    cache.set('key', 'child')
+
+
+class InvalidationBusTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def wait_deleted(self, key):
+        for _ in range(200):
+            if cache.get(key) is None:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def free_port(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind(('127.0.0.1', 0))
+            return probe.getsockname()[1]
+
+    def test_unix_socket_purge_reaches_other_node(self):
+        """Core: Ключ, опубликованный одним узлом, удаляется на другом."""
+        sender = InvalidationBus(
+            UnixSocketTransport(self.directory, 'a'), 'a'
+        )
+        receiver = InvalidationBus(
+            UnixSocketTransport(self.directory, 'b'), 'b'
+        )
+        receiver.start()
+        for _ in range(200):
+            if os.path.exists(receiver.transport.path):
+                break
+            time.sleep(0.01)
+        cache.set('feed_generation:index', 'token')
+        sender.publish(['feed_generation:index'])
+        self.assertTrue(self.wait_deleted('feed_generation:index'))
+
+    def test_udp_purge_reaches_other_node(self):
+        """Core: Ключи рассылаются по UDP пачками и доходят целиком."""
+        port = self.free_port()
+        receiver = InvalidationBus(
+            UDPTransport(bind=('127.0.0.1', port)), 'b'
+        )
+        receiver.start()
+        sender = InvalidationBus(
+            UDPTransport(peers=[('127.0.0.1', port)]), 'a'
+        )
+        keys = [f'key:{number}' for number in range(450)]
+        cache.set_many({key: 1 for key in keys})
+        # Сокет слушателя мог еще не открыться, повторяем отправку
+        for _ in range(50):
+            sender.publish(keys)
+            if self.wait_deleted(keys[-1]):
+                break
+        self.assertEqual(cache.get_many(keys), {})
+
+    def test_own_messages_are_ignored(self):
+        """Core: Узел не сбрасывает ключи по своим же сообщениям."""
+        bus = InvalidationBus(UnixSocketTransport(self.directory, 'a'), 'a')
+        cache.set('key', 1)
+        bus.handle(sign(b'{"node": "a", "keys": ["key"]}'))
+        self.assertEqual(cache.get('key'), 1)
+        bus.handle(sign(b'{"node": "b", "keys": ["key"]}'))
+        self.assertIsNone(cache.get('key'))
+
+    def test_bad_messages_are_dropped(self):
+        """
+        Core: Неподписанные и испорченные сообщения не сбрасывают кэш
+        и не останавливают слушателя.
+        """
+        sender = InvalidationBus(
+            UnixSocketTransport(self.directory, 'a'), 'a'
+        )
+        receiver = InvalidationBus(
+            UnixSocketTransport(self.directory, 'b'), 'b'
+        )
+        receiver.start()
+        for _ in range(200):
+            if os.path.exists(receiver.transport.path):
+                break
+            time.sleep(0.01)
+        cache.set('key', 1)
+        with self.assertLogs('core.invalidation', 'WARNING'):
+            for payload in (
+                b'{"node": "c", "keys": ["key"]}',
+                sign(b'not json'), sign(b'[]'), sign(b'1'), sign(b'"x"'),
+                sign(b'{"node": "c", "keys": "key"}'),
+                sign(b'{"node": "c", "keys": [1]}'),
+            ):
+                sender.transport.publish(payload)
+            time.sleep(0.1)
+        self.assertEqual(cache.get('key'), 1)
+        sender.publish(['key'])
+        self.assertTrue(self.wait_deleted('key'))
+
+    def test_purge_repeats_after_commit(self):
+        """
+        Core: purge() удаляет ключ еще раз после фиксации транзакции,
+        если до нее кэш успели заполнить старыми данными.
+        """
+        cache.set('key', 1)
+        with mock.patch('core.invalidation.transaction.on_commit') as commit:
+            purge(['key'])
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', 'stale')
+        commit.call_args[0][0]()
+        self.assertIsNone(cache.get('key'))
+
+
+class StampedeTests(TestCase):
+    def test_expired_value_refreshed_once(self):
+        """
+        Core: Истекшее значение пересчитывает один поток, остальные
+        сразу получают прежнее.
+        """
+        stampede.fetch('hot', lambda: 'old', 0)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'new'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                stampede.fetch('hot', compute, 60)
+            ))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), ['new'] + ['old'] * 7)
+
+    def test_purged_value_is_a_miss(self):
+        """
+        Core: Пока ключ пересчитывается, истекшее значение отдается,
+        а значение другой версии — нет, и промах не ждет блокировки.
+        """
+        stampede.fetch('feed', lambda: 'old', 0, version=1)
+        self.assertTrue(stampede.acquire('feed'))
+        self.assertEqual(
+            stampede.fetch('feed', lambda: 'new', 60, version=1), 'old'
+        )
+        self.assertTrue(stampede.acquire('cold'))
+        started = time.monotonic()
+        self.assertEqual(
+            stampede.fetch('feed', lambda: 'new', 60, version=2), 'new'
+        )
+        self.assertEqual(
+            stampede.fetch('cold', lambda: 'value', 60), 'value'
+        )
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_early_refresh(self):
+        """
+        Core: Значение пересчитывается досрочно, если пересчет
+        дольше оставшегося срока.
+        """
+        now = time.time()
+        self.assertTrue(stampede.is_fresh(None, 1))
+        self.assertTrue(stampede.is_fresh(now + 60, 0))
+        self.assertFalse(stampede.is_fresh(now - 1, 0))
+        # Пересчет дольше оставшегося срока почти всегда начинается раньше
+        self.assertFalse(stampede.is_fresh(now + 1, 10 ** 6))
+
+    def test_swr_cache_tag(self):
+        """Core: Тег swr_cache кэширует фрагмент до смены версии."""
+        template = Template(
+            '{% load swr_cache %}'
+            '{% swr_cache 60 fragment page version=version %}'
+            '{{ text }}{% endswr_cache %}'
+        )
+        render = (lambda **context: template.render(Context(
+            {'page': 1, **context}
+        )))
+        self.assertEqual(render(text='a', version=1), 'a')
+        self.assertEqual(render(text='b', version=1), 'a')
+        self.assertEqual(render(text='b', version=2), 'b')
@@ -0,0 +1,49 @@
+"""
+Загрузка файлов с ограничением размера.
+
+Каждый файл пишется кусками во временный файл, а не в память, и после
+FILE_UPLOAD_MAX_SIZE байт запись прекращается: остаток тела запроса
+читается и отбрасывается, чтобы разобрать остальные поля формы.
+Вместо файла форма получает пустую заглушку с oversized=True и сама
+сообщает пользователю об ошибке.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class OversizedUpload(InMemoryUploadedFile):
+    """Файл, отброшенный из-за размера; size — сколько пришло байт."""
+
+    oversized = True
+
+    def __init__(self, field_name, name, content_type, size, charset):
+        super().__init__(
+            BytesIO(), field_name, name, content_type, size, charset
+        )
+
+
+class BoundedUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.limit = settings.FILE_UPLOAD_MAX_SIZE
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.limit:
+            if not self.file.closed:
+                # Закрытый временный файл удаляется сам
+                self.file.close()
+            return None
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if self.received > self.limit:
+            return OversizedUpload(
+                self.field_name, self.file_name, self.content_type,
+                self.received, self.charset
+            )
+        return super().file_complete(file_size)
@@ -0,0 +1,36 @@
+"""
+Пулы процессов для фоновой обработки (миниатюры, пересчеты).
+
+Процессы запускаются через spawn: они не наследуют соединения
+с базой и открытые файлы воркера сервера, а Django настраивают
+заново. Поэтому этот модуль не импортирует моделей: его функция
+инициализации распаковывается в процессе до django.setup().
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+
+
+def init_django(settings_module, database_names):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    # Настройки читаются заново из модуля, а база родителя могла
+    # смениться, например на тестовую
+    for alias, name in database_names.items():
+        settings.DATABASES[alias]['NAME'] = name
+    django.setup()
+
+
+def process_pool(workers):
+    database_names = {
+        alias: database['NAME']
+        for alias, database in settings.DATABASES.items()
+    }
+    return ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_django,
+        initargs=(os.environ['DJANGO_SETTINGS_MODULE'], database_names)
+    )
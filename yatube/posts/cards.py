@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core.invalidation import purge
+
+from . import thumbnails
+
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+# Карточка в профиле не повторяет строку с автором
+VARIANTS = ('feed', 'profile')
+
+
+def card_key(post_id, updated, variant):
+    return f'post_card:{variant}:{post_id}:{updated.timestamp()}'
+
+
+def render_cards(posts, variant='feed'):
+    """
+    Разметка карточек страницы в порядке постов. Готовые карточки
+    читаются одним get_many, рендерятся и сохраняются одним set_many
+    только недостающие.
+    """
+    posts = list(posts)
+    keys = [card_key(post.pk, post.updated, variant) for post in posts]
+    cards = cache.get_many(keys)
+    # Миниатюры недостающих карточек ищутся разом, а не тегом на пост;
+    # постам с готовыми вариантами они не нужны
+    thumbnails.prefetch(
+        post.image for key, post in zip(keys, posts)
+        if key not in cards and not post.image_variants
+    )
+    missing = {}
+    for key, post in zip(keys, posts):
+        if key not in cards:
+            missing[key] = render_to_string(CARD_TEMPLATE, {
+                'post': post,
+                'show_author': variant != 'profile',
+            })
+    if missing:
+        cache.set_many(missing, settings.FEED_CACHE_TIMEOUT)
+        cards.update(missing)
+    return [mark_safe(cards[key]) for key in keys]
+
+
+def purge_cards(posts):
+    """Сбрасывает карточки по парам (id поста, дата изменения)."""
+    purge(
+        card_key(post_id, updated, variant)
+        for post_id, updated in posts
+        if updated is not None
+        for variant in VARIANTS
+    )
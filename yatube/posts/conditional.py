@@ -0,0 +1,74 @@
+"""
+Валидаторы для условных GET-запросов (ETag).
+
+Валидатор считается до рендера по поколению ленты из кэша или одним
+коротким запросом, поэтому при совпадении If-None-Match представление
+отвечает 304 без запроса ленты и без шаблона. Смена имени автора
+или адреса группы тоже сбрасывает поколения лент, где они выводятся
+(см. fragments.bump_author и fragments.bump_group).
+"""
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count
+
+from . import fragments
+from .models import Group, Post, User
+
+
+def _etag(request, *parts):
+    # Шапка страницы зависит от пользователя, а формы — от CSRF-куки
+    parts = (
+        request.user.pk,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        *parts,
+    )
+    return hashlib.md5(
+        '|'.join(str(part) for part in parts).encode()
+    ).hexdigest()
+
+
+def _feed_etag(request, feed):
+    return _etag(
+        request, feed, fragments.generation(feed), fragments.page_key(request)
+    )
+
+
+def index_etag(request):
+    return _feed_etag(request, fragments.INDEX)
+
+
+def group_etag(request, slug):
+    group_id = (Group.objects.filter(slug=slug)
+                .values_list('pk', flat=True).first())
+    if group_id is None:
+        return None
+    return _feed_etag(request, fragments.group_feed(group_id))
+
+
+def profile_etag(request, username):
+    author_id = (User.objects.filter(username=username)
+                 .values_list('pk', flat=True).first())
+    if author_id is None:
+        return None
+    return _feed_etag(request, fragments.author_feed(author_id))
+
+
+def post_etag(request, post_id):
+    """
+    Страница поста меняется вместе с самим постом, его комментариями,
+    именем и счетчиком постов автора и адресом группы: все это
+    читается одним запросом.
+    """
+    state = (
+        Post.objects.filter(pk=post_id)
+        .annotate(comments_count=Count('comments'))
+        .values_list(
+            'updated', 'comments_count', 'author__post_stats__posts_count',
+            'author__username', 'author__first_name', 'author__last_name',
+            'group__slug'
+        ).first()
+    )
+    if state is None:
+        return None
+    return _etag(request, 'post', post_id, *state, request.GET.urlencode())
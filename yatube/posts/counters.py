@@ -0,0 +1,129 @@
+import logging
+
+from django.db.models import Count, F
+
+from .models import AuthorStats, FeedCounter, Post
+
+logger = logging.getLogger(__name__)
+
+INDEX = 'index'
+
+
+def group_key(group_id):
+    return f'group:{group_id}'
+
+
+def _get_or_count(key, posts):
+    """
+    Возвращает сохраненный итог ленты. Если счетчика еще нет,
+    один раз считает посты и запоминает результат.
+    """
+    value = (FeedCounter.objects.filter(key=key)
+             .values_list('value', flat=True).first())
+    if value is not None:
+        return value
+    # Если счетчик успел создать параллельный запрос, get_or_create
+    # вернет его значение, а не свой подсчет
+    counter, _ = FeedCounter.objects.get_or_create(
+        key=key, defaults={'value': posts.count()}
+    )
+    return counter.value
+
+
+def index_count():
+    return _get_or_count(INDEX, Post.objects.all())
+
+
+def group_count(group):
+    return _get_or_count(group_key(group.pk), group.posts.all())
+
+
+def create_author_stats(author_ids):
+    """
+    Заводит недостающую статистику авторов одним запросом с GROUP BY
+    и возвращает сохраненную сумму: строки, которые успел создать
+    параллельный запрос, не перезаписываются своим подсчетом.
+    """
+    rows = (Post.objects.filter(author_id__in=author_ids)
+            .order_by().values('author_id')
+            .annotate(posts_count=Count('pk')))
+    counted = {row['author_id']: row['posts_count'] for row in rows}
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=pk, posts_count=counted.get(pk, 0))
+         for pk in author_ids],
+        ignore_conflicts=True
+    )
+    return sum(
+        AuthorStats.objects.filter(user_id__in=author_ids)
+        .values_list('posts_count', flat=True)
+    )
+
+
+def author_count(author):
+    value = (AuthorStats.objects.filter(user_id=author.pk)
+             .values_list('posts_count', flat=True).first())
+    if value is None:
+        value = create_author_stats([author.pk])
+    return value
+
+
+def followed_authors(user):
+    return set(user.follower.values_list('author_id', flat=True))
+
+
+def follow_count(user, author_ids=None):
+    """Итог ленты подписок складывается из счетчиков авторов."""
+    if author_ids is None:
+        author_ids = followed_authors(user)
+    if not author_ids:
+        return 0
+    stats = dict(
+        AuthorStats.objects.filter(user_id__in=author_ids)
+        .values_list('user_id', 'posts_count')
+    )
+    total = sum(stats.values())
+    missing = author_ids - set(stats)
+    if missing:
+        total += create_author_stats(missing)
+    return total
+
+
+def post_keys(post):
+    keys = [INDEX]
+    if post.group_id is not None:
+        keys.append(group_key(post.group_id))
+    return keys
+
+
+def increment(keys, delta=1):
+    """
+    Сдвигает существующие счетчики. Отсутствующие счетчики не создаются:
+    при первом чтении они посчитаются с учетом изменения.
+    """
+    counters = FeedCounter.objects.filter(key__in=keys)
+    if delta < 0:
+        drifted = list(counters.filter(value__lt=-delta)
+                       .values_list('key', flat=True))
+        if drifted:
+            # Счетчик уже разошелся с постами: удаляем его, и первое
+            # чтение посчитает ленту заново
+            logger.warning(
+                'Счетчики лент %s ушли бы ниже нуля, пересчитываем',
+                drifted
+            )
+            FeedCounter.objects.filter(key__in=drifted).delete()
+        counters = counters.filter(value__gte=-delta)
+    counters.update(value=F('value') + delta)
+
+
+def increment_author(author_id, delta=1):
+    """Атомарно сдвигает число постов автора одним UPDATE."""
+    stats = AuthorStats.objects.filter(user_id=author_id)
+    if delta < 0:
+        if stats.filter(posts_count__lt=-delta).exists():
+            logger.warning(
+                'Число постов автора %s ушло бы ниже нуля, '
+                'запустите reconcile_post_counts', author_id
+            )
+        stats = stats.filter(posts_count__gte=-delta)
+    stats.update(posts_count=F('posts_count') + delta)
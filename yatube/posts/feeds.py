@@ -0,0 +1,31 @@
+from .models import Post
+
+# Поля, которые выводят карточки постов в лентах. Остальные колонки
+# (например, почта и пароль автора) из базы не читаются.
+FEED_FIELDS = (
+    'id',
+    'text',
+    'pub_date',
+    'updated',
+    'image',
+    'image_width',
+    'image_height',
+    'image_variants',
+    'image_placeholder',
+    'author__id',
+    'author__username',
+    'author__first_name',
+    'author__last_name',
+    'group__id',
+    'group__slug',
+)
+
+
+def feed_posts(posts=None):
+    """
+    Общая выборка для всех лент: автор и группа присоединяются
+    одним JOIN, поэтому шаблон не делает запросов на каждый пост.
+    """
+    if posts is None:
+        posts = Post.objects.all()
+    return posts.select_related('author', 'group').only(*FEED_FIELDS)
@@ -1,5 +1,9 @@
 from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.template.defaultfilters import filesizeformat
 
+from . import images
 from .models import Comment, Post
 
 
@@ -18,6 +22,32 @@ class PostForm(forms.ModelForm):
             'image': 'Загрузи изображение',
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Файл, отброшенный core.uploads из-за размера, пуст:
+        # ImageField назвал бы его битой картинкой
+        self.oversized = None
+        if getattr(self.files.get('image'), 'oversized', False):
+            self.files = self.files.copy()
+            self.oversized = self.files.pop('image')[0]
+
+    def clean_image(self):
+        if self.oversized is not None:
+            raise ValidationError(
+                'Файл больше %(limit)s.',
+                code='file_too_large',
+                params={
+                    'limit': filesizeformat(settings.FILE_UPLOAD_MAX_SIZE)
+                },
+            )
+        image = self.cleaned_data['image']
+        # У только что загруженного файла ImageField уже разобрал
+        # заголовок; сама картинка при этом не декодируется
+        opened = getattr(image, 'image', None)
+        if opened is not None:
+            images.check_image(opened, settings.IMAGE_MAX_PIXELS)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,162 @@
+import hashlib
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import page_cache
+from core.invalidation import purge
+
+INDEX = 'index'
+
+
+def group_feed(group_id):
+    return f'group:{group_id}'
+
+
+def follow_feed(user_id):
+    return f'follow:{user_id}'
+
+
+def author_feed(author_id):
+    return f'author:{author_id}'
+
+
+def _generation_key(feed):
+    return f'feed_generation:{feed}'
+
+
+def generation(feed):
+    """
+    Текущее поколение ленты. Оно служит версией фрагмента кэша,
+    поэтому смена поколения сразу делает старые страницы устаревшими.
+    """
+    return generations([feed])[0]
+
+
+def generations(feeds):
+    """Поколения нескольких лент одним get_many, в том же порядке."""
+    keys = [_generation_key(feed) for feed in feeds]
+    values = cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        # Поколение — случайный токен, а не счетчик: значение никогда
+        # не повторится, даже если кэш пережил откат данных.
+        # add() не перетирает токен, который успел завести другой процесс.
+        created = {key: uuid4().hex for key in missing}
+        for key, value in created.items():
+            cache.add(key, value, None)
+        created.update(cache.get_many(missing))
+        values.update(created)
+    return [values[key] for key in keys]
+
+
+def bump(feed):
+    """
+    Сбрасывает поколение ленты на всех узлах: следующий запрос
+    заведет новое, и закэшированные страницы перестанут находиться.
+    """
+    purge([_generation_key(feed)])
+
+
+def bump_many(feeds, tags=()):
+    """
+    Сбрасывает несколько лент и теги кэша страниц одним сообщением шины.
+    """
+    purge([
+        *(_generation_key(feed) for feed in feeds),
+        *page_cache.tag_keys(*tags),
+    ])
+
+
+def bump_post(post, previous_group_id=None):
+    """
+    Сбрасывает все ленты и страницы, в которых показывается пост,
+    одним сообщением шины. Ленты подписчиков по одной не сбрасываются:
+    их версия включает поколение автора (см. follow_feed_version).
+    """
+    group_ids = {post.group_id, previous_group_id} - {None}
+    feeds = [
+        INDEX,
+        author_feed(post.author_id),
+        *(group_feed(group_id) for group_id in group_ids),
+    ]
+    bump_many(feeds, [INDEX, *page_tags(post), *map(group_tag, group_ids)])
+
+
+def bump_author(author_id, group_ids):
+    """
+    Сбрасывает все ленты, в карточках которых выводится имя автора:
+    главную, профиль и группы его постов. Ленты подписчиков
+    сбрасываются вместе с поколением автора.
+    """
+    group_ids = set(group_ids) - {None}
+    bump_many(
+        [INDEX, author_feed(author_id), *map(group_feed, group_ids)],
+        [INDEX, author_tag(author_id), *map(group_tag, group_ids)]
+    )
+
+
+def bump_group(group_id, author_ids):
+    """
+    Сбрасывает все ленты со ссылкой на группу: главную, саму группу
+    и профили авторов ее постов вместе с лентами их подписчиков.
+    """
+    author_ids = set(author_ids)
+    bump_many(
+        [INDEX, group_feed(group_id), *map(author_feed, author_ids)],
+        [INDEX, group_tag(group_id), *map(author_tag, author_ids)]
+    )
+
+
+def follow_feed_version(user_id, author_ids):
+    """
+    Версия фрагмента ленты подписок: поколение самой ленты (подписки
+    и отписки) и поколения всех авторов, на которых подписан читатель.
+    Пост сбрасывает одно поколение своего автора, а не по ключу
+    на каждого подписчика, сколько бы их ни было.
+    """
+    values = generations([
+        follow_feed(user_id), *map(author_feed, sorted(author_ids))
+    ])
+    return hashlib.md5('|'.join(values).encode()).hexdigest()
+
+
+def post_tag(post_id):
+    return f'post:{post_id}'
+
+
+def group_tag(group_id):
+    return f'group:{group_id}'
+
+
+def author_tag(author_id):
+    return f'author:{author_id}'
+
+
+def page_tags(post):
+    """
+    Теги страницы поста для кэша страниц (core.page_cache): на ней
+    есть ссылка на группу и счетчик постов автора.
+    """
+    tags = [post_tag(post.pk), author_tag(post.author_id)]
+    if post.group_id is not None:
+        tags.append(group_tag(post.group_id))
+    return tags
+
+
+def page_key(request):
+    """Положение на ленте: номер страницы или курсор."""
+    for param in ('after', 'before', 'page'):
+        value = request.GET.get(param)
+        if value:
+            return f'{param}={value}'
+    return 'page=1'
+
+
+def feed_cache_context(request, feed, version=None):
+    return {
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+        'feed_cache_key': page_key(request),
+        'feed_cache_version': version or generation(feed),
+    }
@@ -0,0 +1,222 @@
+"""
+Сведения о загруженных картинках постов, их адаптивные варианты
+и заглушки на время загрузки.
+"""
+import base64
+import hashlib
+import json
+from io import BytesIO
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+import numpy as np
+from PIL import Image, ImageOps
+
+CHUNK_SIZE = 64 * 1024
+
+# Варианты повторяют кадр миниатюры 960x339 в нескольких ширинах
+VARIANT_WIDTHS = (320, 480, 640, 960)
+VARIANT_RATIO = (960, 339)
+VARIANT_QUALITY = {'AVIF': 50, 'WEBP': 75, 'JPEG': 80}
+VARIANT_EXTENSIONS = {'AVIF': 'avif', 'WEBP': 'webp', 'JPEG': 'jpg'}
+# Карточка занимает всю ширину экрана, но не больше 960 пикселей
+VARIANT_SIZES = '(min-width: 1000px) 960px, 100vw'
+MIME_TYPES = {'AVIF': 'image/avif', 'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+# Форматы, которые принимает форма поста
+UPLOAD_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+# Заглушка — сетка средних цветов кадра 960x339, которую браузер
+# растягивает и размывает до загрузки самой картинки
+PLACEHOLDER_GRID = (16, 6)
+METADATA_FIELDS = (
+    'image_width', 'image_height', 'image_size', 'image_format',
+    'image_hash',
+)
+
+
+def file_hash(file):
+    """SHA-256 и размер файла; файл читается кусками."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in file.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+def image_metadata(file):
+    """
+    Размеры, формат, размер файла и SHA-256. Файл читается кусками,
+    а Pillow разбирает только заголовок и не декодирует картинку.
+    """
+    image_hash, size = file_hash(file)
+    with Image.open(file) as image:
+        width, height = image.size
+        image_format = image.format or ''
+    file.seek(0)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_size': size,
+        'image_format': image_format,
+        'image_hash': image_hash,
+    }
+
+
+def check_image(image, max_pixels):
+    """
+    Проверяет формат и число пикселей открытой картинки Pillow.
+    Нужен только заголовок: «бомба» из нескольких килобайт со сторонами
+    в десятки тысяч пикселей отклоняется до того, как пул миниатюр
+    выделит под нее память.
+    """
+    if image.format not in UPLOAD_FORMATS:
+        raise ValidationError(
+            'Загрузите изображение в формате JPEG, PNG, GIF или WebP.',
+            code='invalid_format'
+        )
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ValidationError(
+            'Слишком большое изображение: %(width)s×%(height)s пикселей.',
+            code='too_many_pixels',
+            params={'width': width, 'height': height},
+        )
+
+
+def crop_box(width, height, ratio=VARIANT_RATIO):
+    """Центральный кадр с пропорциями ratio, как crop='center' у sorl."""
+    ratio_width, ratio_height = ratio
+    if width * ratio_height > height * ratio_width:
+        cropped = round(height * ratio_width / ratio_height)
+        left = (width - cropped) // 2
+        return left, 0, left + cropped, height
+    cropped = round(width * ratio_height / ratio_width)
+    top = (height - cropped) // 2
+    return 0, top, width, top + cropped
+
+
+def placeholder(file, grid=PLACEHOLDER_GRID):
+    """
+    Data URI крошечного PNG со средними цветами кадра. JPEG
+    декодируется сразу в уменьшенном виде (draft), остальные форматы
+    уменьшаются до массива, а усреднение по клеткам сетки делает
+    NumPy одной операцией над массивом.
+    """
+    columns, rows = grid
+    with Image.open(file) as image:
+        # Уменьшение в draft не больше чем до 8 пикселей на клетку
+        image.draft('RGB', (columns * 8, rows * 8))
+        # PNG, GIF и WebP draft не уменьшает: без этого массив float32
+        # строился бы по всем пикселям кадра
+        factor = min(image.size) // (max(grid) * 8)
+        if factor > 1:
+            image = image.resize(
+                (image.width // factor, image.height // factor), Image.BOX
+            )
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    image = image.crop(crop_box(*image.size))
+    pixels = np.asarray(image, dtype=np.float32)
+    height, width = pixels.shape[0] // rows, pixels.shape[1] // columns
+    if not height or not width:
+        # Кадр меньше сетки: клетки повторяют пиксели
+        pixels = np.asarray(image.resize(grid, Image.NEAREST), np.float32)
+        height = width = 1
+    cells = pixels[:rows * height, :columns * width].reshape(
+        rows, height, columns, width, 3
+    ).mean(axis=(1, 3))
+    buffer = BytesIO()
+    Image.fromarray(cells.round().astype(np.uint8)).save(
+        buffer, 'PNG', optimize=True
+    )
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    file.seek(0)
+    return f'data:image/png;base64,{encoded}'
+
+
+def empty_metadata():
+    return {
+        'image_width': None,
+        'image_height': None,
+        'image_size': None,
+        'image_format': '',
+        'image_hash': '',
+    }
+
+
+def variant_formats():
+    """
+    Форматы вариантов по убыванию сжатия. AVIF и WebP берутся, только
+    если их умеет сохранять установленный Pillow; JPEG есть всегда
+    и служит запасным вариантом для старых браузеров.
+    """
+    Image.init()
+    return [
+        image_format for image_format in ('AVIF', 'WEBP')
+        if image_format in Image.SAVE
+    ] + ['JPEG']
+
+
+def variant_widths(source_width):
+    """Ширины не больше исходной: растягивать картинку незачем."""
+    widths = [width for width in VARIANT_WIDTHS if width <= source_width]
+    return widths or [VARIANT_WIDTHS[0]]
+
+
+def render_variants(image, formats=None):
+    """Кадрирует картинку Pillow и отдает (формат, ширина, высота, байты)."""
+    formats = formats or variant_formats()
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    ratio_width, ratio_height = VARIANT_RATIO
+    for width in variant_widths(image.width):
+        height = round(width * ratio_height / ratio_width)
+        frame = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        for image_format in formats:
+            buffer = BytesIO()
+            frame.save(
+                buffer, image_format,
+                quality=VARIANT_QUALITY[image_format], optimize=True
+            )
+            yield image_format, width, height, buffer.getvalue()
+
+
+def variant_directory(image_hash):
+    # Варианты адресуются хэшем исходника: одинаковые загрузки
+    # используют одни и те же файлы
+    return f'variants/{image_hash[:2]}/{image_hash}'
+
+
+def variant_name(image_hash, width, image_format):
+    extension = VARIANT_EXTENSIONS[image_format]
+    return f'{variant_directory(image_hash)}/{width}.{extension}'
+
+
+def build_variants(file, image_hash, storage=default_storage):
+    """
+    Сохраняет варианты картинки и возвращает манифест:
+    {формат: [[ширина, высота, имя файла, байт], ...]}.
+    """
+    manifest = {}
+    with Image.open(file) as image:
+        for image_format, width, height, data in render_variants(image):
+            name = variant_name(image_hash, width, image_format)
+            if not storage.exists(name):
+                name = storage.save(name, ContentFile(data))
+            manifest.setdefault(image_format, []).append(
+                [width, height, name, len(data)]
+            )
+    return manifest
+
+
+def dump_manifest(manifest):
+    return json.dumps(manifest, separators=(',', ':'))
+
+
+def load_manifest(value):
+    if not value:
+        return {}
+    try:
+        return json.loads(value)
+    except ValueError:
+        return {}
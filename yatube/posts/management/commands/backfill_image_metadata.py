@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import METADATA_FIELDS, image_metadata
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет размеры, формат, размер файла и хэш картинок '
+        'у постов, загруженных до появления этих полей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = (Post.objects.exclude(image='').filter(image_hash='')
+                 .only('pk', 'image').order_by('pk'))
+        filled = missing = 0
+        batch = []
+        for post in posts.iterator(chunk_size=batch_size):
+            try:
+                with post.image.open('rb'):
+                    metadata = image_metadata(post.image)
+            except (OSError, ValueError):
+                # Файла нет в хранилище или это не картинка
+                missing += 1
+                continue
+            for field, value in metadata.items():
+                setattr(post, field, value)
+            batch.append(post)
+            if len(batch) >= batch_size:
+                filled += self.save(batch, batch_size)
+        filled += self.save(batch, batch_size)
+        self.stdout.write(
+            f'Заполнено: {filled}, файлов не найдено: {missing}'
+        )
+
+    def save(self, batch, batch_size):
+        # bulk_update не шлет сигналов и не трогает дату изменения поста
+        Post.objects.bulk_update(batch, METADATA_FIELDS, batch_size)
+        count = len(batch)
+        batch.clear()
+        return count
@@ -0,0 +1,81 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.workers import process_pool
+from posts import cards, fragments
+from posts.images import placeholder
+from posts.models import Post
+from posts.storage import image_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит заглушки (posts.images.placeholder) для картинок, '
+        'загруженных до их появления. Картинки декодируются в пуле '
+        'процессов, каждый файл один раз, даже если на него ссылается '
+        'несколько постов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='0 — считать в этом процессе')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        names = (Post.objects.exclude(image='').filter(image_placeholder='')
+                 .order_by('image').values_list('image', flat=True)
+                 .distinct())
+        filled = missing = 0
+        last = ''
+        started = time.perf_counter()
+        pool = process_pool(options['workers']) if options['workers'] else None
+        try:
+            while True:
+                # Пачки по имени файла: курсор не держится открытым,
+                # пока заполненные посты выпадают из выборки
+                batch = list(
+                    names.filter(image__gt=last)[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last = batch[-1]
+                results = (pool.map(placeholder_for, batch) if pool
+                           else map(placeholder_for, batch))
+                for name, data_uri in zip(batch, results):
+                    if data_uri is None:
+                        missing += 1
+                    else:
+                        filled += self.save(name, data_uri)
+        finally:
+            if pool:
+                pool.shutdown()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Заполнено постов: {filled}, файлов не найдено: {missing}, '
+            f'за {elapsed:.1f} с'
+        )
+
+    def save(self, name, data_uri):
+        posts = list(Post.objects.filter(
+            image=name, image_placeholder=''
+        ).only('pk', 'updated', 'author_id', 'group_id'))
+        # update() не трогает дату изменения, поэтому закэшированные
+        # карточки без заглушки сбрасываются явно
+        Post.objects.filter(pk__in=[post.pk for post in posts]).update(
+            image_placeholder=data_uri
+        )
+        cards.purge_cards([(post.pk, post.updated) for post in posts])
+        for post in posts:
+            fragments.bump_post(post)
+        return len(posts)
+
+
+def placeholder_for(name):
+    """Выполняется в пуле: заглушка картинки или None, если файла нет."""
+    try:
+        with image_storage.open(name) as file:
+            return placeholder(file)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,122 @@
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from posts import timeline
+from posts.models import Follow, Post, User
+from posts.paginators import CURSOR_ORDERING, TIMELINE_ORDERING
+from posts.views import POSTS
+
+
+def percentile(values, share):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(share * (len(values) - 1))))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку ленты подписок при чтении через JOIN '
+        'и при гибридной раскладке на графе подписок с перекосом. '
+        'Все тестовые данные откатываются по завершении.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=200)
+        parser.add_argument('--readers', type=int, default=500)
+        parser.add_argument('--posts', type=int, default=20,
+                            help='Постов на автора')
+        parser.add_argument('--follows', type=int, default=50,
+                            help='Максимум подписок у читателя')
+        parser.add_argument('--threshold', type=int, default=100,
+                            help='Порог CELEBRITY_FOLLOWERS')
+        parser.add_argument('--samples', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with override_settings(CELEBRITY_FOLLOWERS=options['threshold']):
+            with transaction.atomic():
+                readers = self.build_graph(options)
+                self.report(readers, options)
+                transaction.set_rollback(True)
+            cache.delete(timeline.celebrities_key())
+
+    def build_graph(self, options):
+        prefix = f'bench{random.randrange(10 ** 9)}'
+        User.objects.bulk_create(
+            User(username=f'{prefix}_a{i}') for i in range(options['authors'])
+        )
+        User.objects.bulk_create(
+            User(username=f'{prefix}_r{i}') for i in range(options['readers'])
+        )
+        authors = list(User.objects.filter(username__startswith=f'{prefix}_a'))
+        readers = list(User.objects.filter(username__startswith=f'{prefix}_r'))
+
+        Post.objects.bulk_create(
+            Post(text='bench', author=author)
+            for author in authors
+            for _ in range(options['posts'])
+        )
+
+        # Популярность авторов по закону Ципфа: первые авторы получают
+        # большую часть подписчиков, как в реальных соцсетях.
+        weights = [1 / rank for rank in range(1, len(authors) + 1)]
+        follows = []
+        for reader in readers:
+            count = random.randint(1, options['follows'])
+            chosen = set(random.choices(authors, weights, k=count))
+            follows.extend(Follow(user=reader, author=a) for a in chosen)
+        Follow.objects.bulk_create(follows)
+        # bulk_create не шлет сигналов, популярные авторы отмечаются явно
+        timeline.promote(timeline.popular_authors())
+
+        for user_id, author_id in (
+            Follow.objects.filter(user__in=readers)
+            .values_list('user_id', 'author_id')
+        ):
+            timeline.backfill(user_id, author_id)
+        celebrities = sum(timeline.is_celebrity(a.pk) for a in authors)
+        self.stdout.write(
+            f'Авторов: {len(authors)} (популярных: {celebrities}), '
+            f'читателей: {len(readers)}, подписок: {len(follows)}'
+        )
+        self.authors = authors
+        return readers
+
+    def measure(self, feed_for, ordering, readers, samples):
+        timings = []
+        for reader in random.choices(readers, k=samples):
+            started = time.perf_counter()
+            list(feed_for(reader).order_by(*ordering)[:POSTS])
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def write_line(self, name, timings):
+        self.stdout.write(
+            f'{name:<24} p50={statistics.median(timings):7.2f} мс  '
+            f'p99={percentile(timings, 0.99):7.2f} мс'
+        )
+
+    def report(self, readers, options):
+        samples = options['samples']
+        self.write_line('чтение: JOIN', self.measure(
+            lambda user: Post.objects.filter(author__following__user=user),
+            CURSOR_ORDERING, readers, samples
+        ))
+        self.write_line('чтение: гибрид', self.measure(
+            timeline.follow_feed, TIMELINE_ORDERING, readers, samples
+        ))
+
+        writes = []
+        for author in random.choices(self.authors, k=samples):
+            post = Post(text='bench', author=author)
+            started = time.perf_counter()
+            post.save()
+            writes.append((time.perf_counter() - started) * 1000)
+        self.write_line('запись: пост', writes)
@@ -0,0 +1,111 @@
+import os
+import random
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw, ImageOps
+
+from posts import images
+
+BASELINE_SIZE = (960, 339)
+BASELINE_QUALITY = 95
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает объем адаптивных вариантов картинок с единственной '
+        'миниатюрой 960x339 JPEG, которую лента отдавала раньше. '
+        'Варианты строятся в памяти, хранилище не меняется.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=50,
+                            help='Картинок из MEDIA_ROOT/posts')
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Сгенерировать столько картинок вместо '
+                                 'чтения загруженных')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        if options['synthetic']:
+            corpus = [synthetic_image() for _ in range(options['synthetic'])]
+        else:
+            corpus = list(self.uploaded(options['limit']))
+        if not corpus:
+            self.stdout.write(
+                'Картинок не найдено, используйте --synthetic N'
+            )
+            return
+
+        formats = images.variant_formats()
+        baseline = 0
+        # {(формат, ширина): байт}
+        totals = {}
+        started = time.perf_counter()
+        for image in corpus:
+            baseline += len(encode(
+                ImageOps.fit(image.convert('RGB'), BASELINE_SIZE,
+                             Image.LANCZOS),
+                'JPEG', BASELINE_QUALITY
+            ))
+            for image_format, width, _, data in images.render_variants(
+                image, formats
+            ):
+                key = (image_format, width)
+                totals[key] = totals.get(key, 0) + len(data)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'Картинок: {len(corpus)}, форматы: {", ".join(formats)}, '
+            f'за {elapsed:.1f} с'
+        )
+        self.stdout.write(
+            f'{"JPEG 960 q95 (прежде)":>24} {baseline / 1024:10.1f} КБ'
+        )
+        for (image_format, width), size in sorted(totals.items()):
+            self.stdout.write(
+                f'{image_format:>14} {width:>4} пикс. '
+                f'{size / 1024:10.1f} КБ  {saving(size, baseline):6.1f} %'
+            )
+
+    def uploaded(self, limit):
+        directory = os.path.join(settings.MEDIA_ROOT, 'posts')
+        if not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory))[:limit]:
+            try:
+                with Image.open(os.path.join(directory, name)) as image:
+                    image.load()
+                    yield image
+            except OSError:
+                continue
+
+
+def encode(image, image_format, quality):
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def saving(size, baseline):
+    """На сколько процентов меньше прежней миниатюры."""
+    return (1 - size / baseline) * 100
+
+
+def synthetic_image(width=1600, height=1200):
+    """Градиент с фигурами: сжимается похоже на фотографию."""
+    image = Image.linear_gradient('L').resize((width, height)).convert(
+        'RGB'
+    )
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = random.randrange(width), random.randrange(height)
+        radius = random.randint(20, 200)
+        draw.ellipse(
+            (x - radius, y - radius, x + radius, y + radius),
+            fill=tuple(random.randrange(256) for _ in range(3))
+        )
+    return image
@@ -0,0 +1,83 @@
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from posts.models import Group, Post, User
+
+from .bench_follow_feed import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность анонимных страниц '
+        'с кэшем страниц и без него. Тестовые данные откатываются '
+        'по завершении.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with override_settings(ALLOWED_HOSTS=['*']):
+            with transaction.atomic():
+                urls = self.build_site(options)
+                cache.clear()
+                with override_settings(PAGE_CACHE_TIMEOUT=0):
+                    self.write_line('без кэша страниц', self.measure(
+                        urls, options['requests']
+                    ))
+                self.write_line('с кэшем страниц', self.measure(
+                    urls, options['requests']
+                ))
+                transaction.set_rollback(True)
+            cache.clear()
+
+    def build_site(self, options):
+        prefix = f'bench{random.randrange(10 ** 9)}'
+        author = User.objects.create(username=f'{prefix}_author')
+        groups = Group.objects.bulk_create(
+            Group(title=f'{prefix} {i}', slug=f'{prefix}-{i}',
+                  description='bench')
+            for i in range(options['groups'])
+        )
+        Post.objects.bulk_create(
+            Post(text='bench', author=author, group=random.choice(groups))
+            for _ in range(options['posts'])
+        )
+        posts = Post.objects.filter(author=author).values_list(
+            'pk', flat=True
+        )
+        # Главная и группы читаются чаще отдельных постов
+        return (
+            [reverse('posts:index')] * 5
+            + [reverse('posts:group_list', args=[group.slug])
+               for group in groups]
+            + [reverse('posts:post_detail', args=[pk]) for pk in posts[:50]]
+        )
+
+    def measure(self, urls, count):
+        client = Client()
+        timings = []
+        for url in random.choices(urls, k=count):
+            started = time.perf_counter()
+            client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def write_line(self, name, timings):
+        self.stdout.write(
+            f'{name:<18} {len(timings) / sum(timings) * 1000:8.1f} запр/с  '
+            f'p50={statistics.median(timings):6.2f} мс  '
+            f'p99={percentile(timings, 0.99):6.2f} мс'
+        )
@@ -0,0 +1,150 @@
+import os
+import resource
+import struct
+import tempfile
+import time
+import warnings
+import zlib
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.management.base import BaseCommand
+from django.utils.datastructures import MultiValueDict
+from PIL import Image
+
+from core.uploads import BoundedUploadHandler
+from core.workers import process_pool
+from posts.forms import PostForm
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пиковую память воркера при загрузке больших картинок: '
+        'прежний путь (forms.ImageField и декодирование принятого файла) '
+        'и ограниченный (core.uploads и проверки PostForm). Каждый случай '
+        'выполняется в отдельном процессе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bomb-side', type=int, default=12000,
+                            help='Сторона PNG-«бомбы» в пикселях')
+        parser.add_argument('--photo-size', type=int, nargs=2,
+                            default=(4000, 3000), metavar=('W', 'H'),
+                            help='Размер шумной JPEG-фотографии')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            inputs = [
+                write_bomb(directory, options['bomb_side']),
+                write_photo(directory, *options['photo_size']),
+            ]
+            for path in inputs:
+                self.stdout.write(
+                    f'{os.path.basename(path)}: '
+                    f'{os.path.getsize(path) / 2 ** 20:.1f} МБ'
+                )
+                for bounded in (False, True):
+                    # Свежий процесс на случай: пик RSS не убывает
+                    with process_pool(1) as pool:
+                        result, peak, elapsed = pool.submit(
+                            measure, path, bounded
+                        ).result()
+                    self.stdout.write(
+                        f'  {"ограниченный" if bounded else "прежний":>12}'
+                        f' {peak:8.1f} МБ {elapsed * 1000:8.1f} мс  {result}'
+                    )
+
+
+def measure(path, bounded):
+    """
+    Загрузка файла кусками, проверка поля формы и, если файл принят,
+    декодирование, как при построении миниатюр. Возвращает итог,
+    прирост пикового RSS в МБ и время.
+    """
+    before = peak_rss()
+    started = time.perf_counter()
+    handler = (BoundedUploadHandler if bounded
+               else TemporaryFileUploadHandler)(None)
+    handler.new_file('image', os.path.basename(path), 'image/png',
+                     os.path.getsize(path))
+    size = 0
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            handler.receive_data_chunk(chunk, size)
+            size += len(chunk)
+    uploaded = handler.file_complete(size)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            if bounded:
+                form = PostForm(
+                    {'text': 'Пост'}, MultiValueDict({'image': [uploaded]})
+                )
+                if not form.is_valid():
+                    raise ValidationError(form.errors['image'])
+            else:
+                forms.ImageField().clean(uploaded)
+    except ValidationError as error:
+        result = f'отклонен: {error.messages[0]}'
+    else:
+        uploaded.seek(0)
+        Image.MAX_IMAGE_PIXELS = None
+        with Image.open(uploaded) as image:
+            image.load()
+        result = 'принят и декодирован'
+    finally:
+        uploaded.close()
+    elapsed = time.perf_counter() - started
+    return result, (peak_rss() - before) / 1024, elapsed
+
+
+def peak_rss():
+    """
+    Пиковый RSS процесса в КБ. ru_maxrss на Linux переживает exec()
+    и у порожденного процесса начинается с пика родителя, поэтому
+    сначала читается VmHWM.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def png_chunk(kind, data):
+    return (struct.pack('>I', len(data)) + kind + data
+            + struct.pack('>I', zlib.crc32(kind + data)))
+
+
+def write_bomb(directory, side):
+    """
+    Корректный PNG из нулей в оттенках серого: файл занимает сотни
+    килобайт, а в памяти картинка займет side² байт.
+    """
+    path = os.path.join(directory, f'bomb_{side}x{side}.png')
+    compressor = zlib.compressobj(9)
+    row = bytes(side + 1)
+    with open(path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(png_chunk(
+            b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 0, 0, 0, 0)
+        ))
+        data = b''.join(compressor.compress(row) for _ in range(side))
+        file.write(png_chunk(b'IDAT', data + compressor.flush()))
+        file.write(png_chunk(b'IEND', b''))
+    return path
+
+
+def write_photo(directory, width, height):
+    """Шум почти не сжимается: JPEG больше десяти мегабайт."""
+    path = os.path.join(directory, f'photo_{width}x{height}.jpg')
+    image = Image.frombytes('RGB', (width, height),
+                            os.urandom(width * height * 3))
+    image.save(path, 'JPEG', quality=95)
+    return path
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Переводит авторов между раскладкой постов по лентам '
+        'и подтягиванием при чтении: популярными становятся авторы '
+        'с CELEBRITY_FOLLOWERS подписчиков и больше, обратно '
+        'на раскладку — те, у кого их меньше CELEBRITY_DEMOTE_FOLLOWERS. '
+        'Посты таких авторов раскладываются по лентам здесь, а не '
+        'в запросе отписки, поэтому команду запускают по расписанию.'
+    )
+
+    def handle(self, *args, **options):
+        promoted = timeline.promote(timeline.popular_authors())
+        demoted = sum(
+            timeline.demote(author_id)
+            for author_id in timeline.fading_celebrities()
+        )
+        self.stdout.write(
+            f'Стали популярными: {promoted}, '
+            f'переведены на раскладку: {demoted}'
+        )
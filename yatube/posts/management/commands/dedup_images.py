@@ -0,0 +1,111 @@
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts import cards, fragments
+from posts.images import file_hash
+from posts.models import Post, StoredImage
+from posts.storage import hashed_name, image_storage, name_hash
+
+
+class Command(BaseCommand):
+    help = (
+        'Переводит загруженные раньше картинки постов на имена по SHA-256 '
+        '(posts.storage): одинаковые файлы сливаются в один, посты '
+        'переставляются на него, счетчики ссылок пересчитываются. '
+        'Файлы обходятся по одному и читаются кусками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, ничего не менять')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        upload_to = Post._meta.get_field('image').upload_to.strip('/')
+        moved = merged = freed = repointed = 0
+        planned = set()
+        for name in self.walk(upload_to):
+            if name_hash(name):
+                continue
+            with image_storage.open(name) as file:
+                digest, size = file_hash(File(file))
+            target = hashed_name(
+                posixpath.join(upload_to, posixpath.basename(name)), digest
+            )
+            duplicate = target in planned or image_storage.exists(target)
+            if duplicate:
+                merged += 1
+                freed += size
+            else:
+                moved += 1
+            if dry_run:
+                # Без переноса дубликат виден только по уже учтенным
+                planned.add(target)
+                continue
+            # Старый файл удаляется только после того, как посты
+            # переставлены: прерванная команда не оставит постов
+            # со ссылкой на удаленный файл
+            if not duplicate:
+                path = image_storage.path(target)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                try:
+                    os.link(image_storage.path(name), path)
+                except FileExistsError:
+                    # Такой же файл успели сохранить под этим именем
+                    pass
+            repointed += self.repoint(name, target, digest)
+            image_storage.delete(name)
+
+        if not dry_run:
+            self.count_refs()
+        self.stdout.write(
+            f'Перенесено: {moved}, слито дубликатов: {merged} '
+            f'({freed / 2 ** 20:.1f} МБ), постов переставлено: {repointed}'
+            + (' (пробный прогон)' if dry_run else '')
+        )
+
+    def walk(self, directory):
+        """Имена файлов каталога в хранилище, без списка в памяти."""
+        root = image_storage.path(directory)
+        for path, _, filenames in os.walk(root):
+            relative = os.path.relpath(path, image_storage.location)
+            for filename in filenames:
+                yield posixpath.join(*relative.split(os.sep), filename)
+
+    def repoint(self, name, target, digest):
+        posts = list(Post.objects.filter(image=name).only(
+            'pk', 'updated', 'author_id', 'group_id'
+        ))
+        if not posts:
+            return 0
+        # update() не шлет сигналов: счетчики ссылок пересчитываются
+        # в конце, а закэшированные карточки со старым адресом
+        # сбрасываются здесь
+        Post.objects.filter(image=name).update(
+            image=target, image_hash=digest
+        )
+        # Миниатюры старого имени могли построить и до перехода
+        # на posts.storage, и после: ключ sorl включает хранилище
+        for source in (name, ImageFile(name, image_storage)):
+            default.backend.delete(source, delete_file=False)
+        cards.purge_cards([(post.pk, post.updated) for post in posts])
+        for post in posts:
+            fragments.bump_post(post)
+        return len(posts)
+
+    @transaction.atomic
+    def count_refs(self):
+        rows = (Post.objects.exclude(image='').order_by().values('image')
+                .annotate(refs=Count('pk')))
+        StoredImage.objects.all().delete()
+        StoredImage.objects.bulk_create(
+            StoredImage(name=row['image'], refs=row['refs']) for row in rows
+            if name_hash(row['image'])
+        )
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from posts import timeline
+from posts.feeds import feed_posts
+from posts.models import Follow, Group, Post, User
+from posts.paginators import CURSOR_ORDERING, TIMELINE_ORDERING
+from posts.views import COMMENTS, POSTS
+
+
+class Command(BaseCommand):
+    help = (
+        'Печатает EXPLAIN QUERY PLAN запросов лент и проверяет, '
+        'что ни один из них не сортирует строки во временном B-tree.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Имя читателя для ленты подписок, по умолчанию первый'
+        )
+
+    def get_user(self, username):
+        if username is None:
+            return User.objects.order_by('pk').first() or User(pk=1)
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {username} не найден')
+
+    def queries(self, user):
+        # Значения фильтров не влияют на план, поэтому подходят любые id
+        group = Group.objects.order_by('pk').first() or Group(pk=1)
+        post = Post.objects.order_by('pk').first() or Post(pk=1)
+        return {
+            'index': feed_posts().order_by(*CURSOR_ORDERING)[:POSTS],
+            'group_list': feed_posts(group.posts.all())
+            .order_by(*CURSOR_ORDERING)[:POSTS],
+            'profile': feed_posts(user.posts.all())
+            .order_by(*CURSOR_ORDERING)[:POSTS],
+            # Лента подписок сливается из двух запросов (MergedFeed),
+            # у каждого свой план. Запрос популярных авторов
+            # показывается, даже если читатель на них не подписан.
+            'follow_index pushed': timeline.pushed_posts(user, feed_posts())
+            .order_by(*TIMELINE_ORDERING)[:POSTS],
+            'follow_index celebrities': timeline.pulled_posts(
+                feed_posts(), timeline.followed_celebrities(user) or [user.pk]
+            ).order_by(*TIMELINE_ORDERING)[:POSTS],
+            'post_detail comments': post.comments.select_related('author')
+            .order_by('-created', '-pk')[:COMMENTS + 1],
+            'fan-out followers': Follow.objects.filter(author=user)
+            .values_list('user_id', flat=True),
+        }
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(
+                'Отчет рассчитан на EXPLAIN QUERY PLAN из SQLite'
+            )
+        failed = []
+        user = self.get_user(options['user'])
+        for name, queryset in self.queries(user).items():
+            plan = queryset.explain()
+            sorts = 'TEMP B-TREE' in plan
+            scans = [
+                line for line in plan.splitlines()
+                if 'SCAN' in line and 'USING' not in line
+            ]
+            ok = not sorts and not scans
+            if not ok:
+                failed.append(name)
+            status = self.style.SUCCESS('OK') if ok else self.style.ERROR(
+                'FAIL'
+            )
+            self.stdout.write(f'{status} {name}')
+            for line in plan.splitlines():
+                self.stdout.write(f'    {line}')
+        if failed:
+            raise CommandError(
+                'Запросы без подходящего индекса: ' + ', '.join(failed)
+            )
@@ -0,0 +1,184 @@
+import json
+import os
+import tempfile
+import time
+from itertools import repeat
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.images import deserialize_image_file
+
+from core.workers import process_pool
+from posts import cards, fragments, thumbnails
+from posts.models import Post
+
+# Прогресс хранится в каталоге приложения, а не в общем /tmp,
+# где путь заранее известен другим пользователям машины
+CHECKPOINT = os.path.join(settings.BASE_DIR, 'var', 'rebuild_thumbnails.json')
+
+
+class Throttle:
+    """Не дает работе идти быстрее rate единиц в секунду."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.total = 0
+        self.started = time.monotonic()
+
+    def wait(self, amount):
+        if not self.rate:
+            return
+        self.total += amount
+        delay = self.total / self.rate - (time.monotonic() - self.started)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Command(BaseCommand):
+    help = (
+        'Заранее строит миниатюры всех размеров из posts.thumbnails.SIZES '
+        'для картинок постов в пуле процессов и пачками записывает их '
+        'в KV-хранилище sorl. Запускается после смены размеров, чтобы '
+        'миниатюры не строились под живым трафиком. Прогресс сохраняется '
+        'после каждой пачки, прерванный запуск продолжается с того же '
+        'места.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='0 — строить в этом процессе')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--force', action='store_true',
+                            help='Перестроить и уже существующие файлы')
+        parser.add_argument('--checkpoint', default=CHECKPOINT)
+        parser.add_argument('--restart', action='store_true',
+                            help='Начать сначала, не читая прогресс')
+        parser.add_argument('--max-rate', type=float, default=0,
+                            help='Не больше картинок в секунду')
+        parser.add_argument('--max-io', type=float, default=0,
+                            help='Не больше МБ/с чтения и записи')
+
+    def handle(self, *args, **options):
+        state = self.load(options['checkpoint'], options['restart'])
+        if state['done']:
+            self.stdout.write(
+                f'Продолжаем после {state["last"]} '
+                f'(готово картинок: {state["done"]})'
+            )
+        names = (Post.objects.exclude(image='').order_by('image')
+                 .values_list('image', flat=True).distinct())
+        workers = options['workers']
+        images_throttle = Throttle(options['max_rate'])
+        io_throttle = Throttle(options['max_io'] * 2 ** 20)
+        processed = 0
+        started = time.perf_counter()
+        pool = process_pool(workers) if workers else None
+        try:
+            while True:
+                # Пачки по имени файла: с него же продолжается
+                # прерванный запуск
+                batch = list(
+                    names.filter(image__gt=state['last'])
+                    [:options['batch_size']]
+                )
+                if not batch:
+                    break
+                force = repeat(options['force'])
+                results = (
+                    pool.map(thumbnails.rebuild, batch, force)
+                    if pool else map(thumbnails.rebuild, batch, force)
+                )
+                io_bytes = self.store(batch, results, state)
+                state['last'] = batch[-1]
+                self.save(options['checkpoint'], state)
+                processed += len(batch)
+                self.stdout.write(
+                    f'{state["done"]} картинок, {state["created"]} '
+                    f'миниатюр создано, {state["missing"]} без файла'
+                )
+                images_throttle.wait(len(batch))
+                io_throttle.wait(io_bytes)
+        finally:
+            if pool:
+                pool.shutdown()
+        elapsed = time.perf_counter() - started
+        # Все сделано: следующий запуск начнется сначала
+        if os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(
+            f'Готово: {state["done"]} картинок, {state["created"]} миниатюр '
+            f'создано, файлов не найдено: {state["missing"]}. '
+            f'За этот запуск {processed} за {elapsed:.1f} с: '
+            f'{rate:.1f} изобр./с, {rate / max(workers, 1):.1f} '
+            f'изобр./с на ядро ({max(workers, 1)} проц.)'
+        )
+
+    def store(self, batch, results, state):
+        """Пишет пачку в KV-хранилище и сбрасывает устаревшие карточки."""
+        entries = []
+        changed = []
+        io_bytes = 0
+        for name, result in zip(batch, results):
+            if result is None:
+                state['missing'] += 1
+                continue
+            source, rendered, created, read_written = result
+            entries.append((
+                deserialize_image_file(source),
+                [deserialize_image_file(thumbnail) for thumbnail in rendered],
+            ))
+            state['done'] += 1
+            state['created'] += created
+            io_bytes += read_written
+            if created:
+                changed.append(name)
+        if entries:
+            default.kvstore.set_many(entries)
+        # Посты с вариантами (posts.images) миниатюры не показывают
+        posts = list(Post.objects.filter(
+            image__in=changed, image_variants=''
+        ).only('pk', 'updated', 'author_id', 'group_id'))
+        cards.purge_cards([(post.pk, post.updated) for post in posts])
+        for post in posts:
+            fragments.bump_post(post)
+        return io_bytes
+
+    def load(self, path, restart):
+        """Прогресс прошлого запуска, если он был для тех же размеров."""
+        state = {
+            'sizes': thumbnails.SIZES,
+            'last': '',
+            'done': 0,
+            'created': 0,
+            'missing': 0,
+        }
+        if restart or not os.path.exists(path):
+            return state
+        with open(path) as file:
+            saved = json.load(file)
+        if saved.get('sizes') != state['sizes']:
+            self.stdout.write(
+                'Прогресс сохранен для других размеров, начинаем сначала'
+            )
+            return state
+        return saved
+
+    def save(self, path, state):
+        # Файл заменяется целиком: обрыв не оставит его половину.
+        # Временный файл создается заново со случайным именем,
+        # поэтому подложенная ссылка на чужой файл не сработает
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(
+            dir=directory, suffix='.tmp'
+        )
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(state, file)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
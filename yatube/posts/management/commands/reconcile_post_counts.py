@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from posts.models import AuthorStats, Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет сохраненное число постов авторов с таблицей постов '
+        'и исправляет расхождения пачками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, ничего не менять'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        actual = dict(
+            Post.objects.order_by().values_list('author_id')
+            .annotate(posts_count=Count('pk'))
+        )
+        stored = dict(
+            AuthorStats.objects.values_list('user_id', 'posts_count')
+        )
+
+        drifted = [
+            AuthorStats(user_id=pk, posts_count=actual.get(pk, 0))
+            for pk, value in stored.items()
+            if actual.get(pk, 0) != value
+        ]
+        missing = [
+            AuthorStats(user_id=pk, posts_count=value)
+            for pk, value in actual.items()
+            if pk not in stored
+        ]
+
+        if not options['dry_run']:
+            with transaction.atomic():
+                AuthorStats.objects.bulk_update(
+                    drifted, ['posts_count'], batch_size=batch_size
+                )
+                AuthorStats.objects.bulk_create(
+                    missing, batch_size=batch_size, ignore_conflicts=True
+                )
+
+        self.stdout.write(
+            f'Авторов проверено: {len(stored) + len(missing)}, '
+            f'исправлено: {len(drifted)}, добавлено: {len(missing)}'
+        )
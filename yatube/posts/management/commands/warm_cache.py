@@ -0,0 +1,114 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+
+from posts.models import Group, Post, User
+
+NEXT_PAGE = re.compile(r'href="(\?after=[^"]+)"')
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогревает кэш после деплоя: первые страницы главной, '
+        'крупнейших групп, профилей популярных авторов и свежие посты. '
+        'Страницы запрашиваются анонимно и только читаются, поэтому '
+        'команду можно запускать на работающем сайте.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=5,
+                            help='Страниц каждой ленты')
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--profiles', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=50,
+                            help='Свежих постов')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument(
+            '--host',
+            help='Хост, под которым страницы попадут в кэш '
+                 '(по умолчанию первый из ALLOWED_HOSTS)'
+        )
+
+    def default_host(self):
+        for host in settings.ALLOWED_HOSTS:
+            if host != '*':
+                return host.lstrip('.')
+        raise CommandError('ALLOWED_HOSTS не задает хост, укажите --host')
+
+    def handle(self, *args, **options):
+        # Ключ кэша страниц включает хост: страницы, прогретые под
+        # testserver, реальные запросы не нашли бы
+        self.host = options['host'] or self.default_host()
+        pages = options['pages']
+        jobs = [(reverse('posts:index'), pages)]
+        jobs += [
+            (reverse('posts:group_list', args=[slug]), pages)
+            for slug in Group.objects.annotate(
+                posts_count=Count('posts')
+            ).order_by('-posts_count').values_list(
+                'slug', flat=True
+            )[:options['groups']]
+        ]
+        jobs += [
+            (reverse('posts:profile', args=[username]), pages)
+            for username in User.objects.annotate(
+                followers=Count('following')
+            ).order_by('-followers').values_list(
+                'username', flat=True
+            )[:options['profiles']]
+        ]
+        jobs += [
+            (reverse('posts:post_detail', args=[pk]), 1)
+            for pk in Post.objects.values_list(
+                'pk', flat=True
+            )[:options['posts']]
+        ]
+
+        started = time.perf_counter()
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(options['workers']) as executor:
+                results = list(executor.map(self.crawl_in_thread, jobs))
+        else:
+            results = [self.crawl(*job) for job in jobs]
+        elapsed = time.perf_counter() - started
+
+        timings = [timing for result in results for timing in result]
+        for url, status, duration in timings:
+            self.stdout.write(f'{status} {duration:8.1f} мс  {url}')
+        failed = sum(status != 200 for _, status, _ in timings)
+        self.stdout.write(
+            f'Прогрето страниц: {len(timings)}, ошибок: {failed}, '
+            f'за {elapsed:.1f} с'
+        )
+
+    def crawl(self, url, pages):
+        """Проходит ленту по ссылкам «Следующая», как читатель."""
+        client = Client(HTTP_HOST=self.host, SERVER_NAME=self.host)
+        timings = []
+        for _ in range(pages):
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((
+                url,
+                response.status_code,
+                (time.perf_counter() - started) * 1000
+            ))
+            found = NEXT_PAGE.search(response.content.decode())
+            if response.status_code != 200 or found is None:
+                break
+            url = url.split('?')[0] + found.group(1)
+        return timings
+
+    def crawl_in_thread(self, job):
+        try:
+            return self.crawl(*job)
+        finally:
+            # Потоки пула открывают свои соединения с базой
+            connections.close_all()
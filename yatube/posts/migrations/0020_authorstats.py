@@ -0,0 +1,43 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_author_stats(apps, schema_editor):
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    FeedCounter = apps.get_model('posts', 'FeedCounter')
+    Post = apps.get_model('posts', 'Post')
+    rows = Post.objects.order_by().values('author_id').annotate(
+        posts_count=models.Count('pk')
+    )
+    AuthorStats.objects.bulk_create(
+        (AuthorStats(user_id=row['author_id'], posts_count=row['posts_count'])
+         for row in rows),
+        batch_size=500
+    )
+    FeedCounter.objects.filter(key__startswith='author:').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0019_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='post_stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Всего постов')),
+            ],
+            options={
+                'verbose_name': 'Статистика автора',
+                'verbose_name_plural': 'Статистика авторов',
+            },
+        ),
+        migrations.RunPython(fill_author_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0025_stored_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, help_text='Data URI со средними цветами картинки (posts.images)', verbose_name='Заглушка изображения'),
+        ),
+    ]
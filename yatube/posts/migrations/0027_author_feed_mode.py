@@ -0,0 +1,45 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:08
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def mark_celebrities(apps, schema_editor):
+    # Раньше популярность считалась по числу подписчиков при каждом
+    # обращении, теперь она хранится в AuthorStats
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    authors = list(
+        Follow.objects.order_by().values('author_id')
+        .annotate(followers=Count('pk'))
+        .filter(followers__gte=settings.CELEBRITY_FOLLOWERS)
+        .values_list('author_id', flat=True)
+    )
+    counted = dict(
+        Post.objects.filter(author_id__in=authors).order_by()
+        .values_list('author_id').annotate(Count('pk'))
+    )
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=pk, posts_count=counted.get(pk, 0))
+         for pk in authors],
+        ignore_conflicts=True
+    )
+    AuthorStats.objects.filter(user_id__in=authors).update(feed_mode=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0026_post_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorstats',
+            name='feed_mode',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Раскладываются по лентам'), (1, 'Подтягиваются при чтении'), (2, 'Переводятся в раскладку')], db_index=True, default=0, verbose_name='Посты в лентах подписок'),
+        ),
+        migrations.RunPython(mark_celebrities, migrations.RunPython.noop),
+    ]
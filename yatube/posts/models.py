@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from .storage import image_storage
+
 
 User = get_user_model()
 
@@ -29,12 +31,45 @@ class Post(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True
+    )
     image = models.ImageField(
         'Изображение',
         upload_to='posts/',
+        storage=image_storage,
         blank=True,
+        db_index=True,
         help_text='Загрузите изображение',
     )
+    # Сведения о картинке заполняются при загрузке (posts.images),
+    # чтобы шаблонам и миниатюрам не открывать файл ради размеров
+    image_width = models.PositiveIntegerField(
+        'Ширина изображения', null=True, blank=True, editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота изображения', null=True, blank=True, editable=False
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер файла изображения, байт',
+        null=True, blank=True, editable=False
+    )
+    image_format = models.CharField(
+        'Формат изображения', max_length=10, blank=True, editable=False
+    )
+    image_hash = models.CharField(
+        'SHA-256 изображения', max_length=64, blank=True, editable=False,
+        db_index=True
+    )
+    image_variants = models.TextField(
+        'Варианты изображения', blank=True, editable=False,
+        help_text='JSON-манифест адаптивных вариантов (posts.images)'
+    )
+    image_placeholder = models.TextField(
+        'Заглушка изображения', blank=True, editable=False,
+        help_text='Data URI со средними цветами картинки (posts.images)'
+    )
 
     # Аргумент upload_to указывает директорию,
     # в которую будут загружаться пользовательские файлы.
@@ -43,6 +78,18 @@ class Post(models.Model):
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Индексы повторяют фильтр и сортировку лент автора и группы,
+        # чтобы страница читалась по индексу без отдельной сортировки.
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_feed_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_feed_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -95,6 +142,12 @@ class Comment(models.Model):
         ordering = ['-created']
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='comment_post_feed_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text
@@ -127,6 +180,124 @@ class Follow(models.Model):
                 name='unique_follow'
             )
         ]
+        # Раскладка поста по лентам читает подписчиков автора
+        # прямо из индекса, не обращаясь к строкам таблицы.
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'Модель подписки f{self.user} -> f{self.author}'
+
+
+class FeedCounter(models.Model):
+    # Готовые итоги для паджинаторов лент: 'index', 'group:<id>'.
+    # Меняются сигналами при создании и удалении поста,
+    # поэтому номерная навигация не делает COUNT(*) по всей таблице.
+    key = models.CharField(
+        'Лента',
+        max_length=64,
+        primary_key=True
+    )
+    value = models.PositiveIntegerField('Количество постов', default=0)
+
+    class Meta:
+        verbose_name = 'Счетчик ленты'
+        verbose_name_plural = 'Счетчики лент'
+
+    def __str__(self):
+        return f'{self.key}: {self.value}'
+
+
+class AuthorStats(models.Model):
+    # Число постов автора хранится рядом с пользователем, чтобы профиль
+    # и страница поста не считали author.posts при каждом просмотре.
+    # Здесь же хранится, как посты автора попадают в ленты подписок
+    # (posts.timeline).
+    PUSHED = 0
+    PULLED = 1
+    DEMOTING = 2
+    FEED_MODES = (
+        (PUSHED, 'Раскладываются по лентам'),
+        (PULLED, 'Подтягиваются при чтении'),
+        (DEMOTING, 'Переводятся в раскладку'),
+    )
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='post_stats',
+        verbose_name='Автор'
+    )
+    posts_count = models.PositiveIntegerField('Всего постов', default=0)
+    feed_mode = models.PositiveSmallIntegerField(
+        'Посты в лентах подписок',
+        choices=FEED_MODES,
+        default=PUSHED,
+        db_index=True
+    )
+
+    class Meta:
+        verbose_name = 'Статистика автора'
+        verbose_name_plural = 'Статистика авторов'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.posts_count}'
+
+
+class TimelineEntry(models.Model):
+    # Лента подписок, разложенная по читателям при публикации поста:
+    # follow_index читает только строки своего пользователя.
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    # Копия даты поста: лента сортируется по индексу этой таблицы,
+    # без сортировки присоединенных постов.
+    pub_date = models.DateTimeField('Дата публикации поста')
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Записи ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_feed_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'Лента {self.user_id}: пост {self.post_id}'
+
+
+class StoredImage(models.Model):
+    # Файл картинки в хранилище posts.storage и число постов с ним:
+    # одинаковые загрузки делят один файл, и удалять его можно
+    # только вместе с последним постом.
+    name = models.CharField('Файл', max_length=100, primary_key=True)
+    refs = models.PositiveIntegerField('Ссылок', default=0)
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return f'{self.name}: {self.refs}'
@@ -0,0 +1,166 @@
+import base64
+import binascii
+
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+# Ключ сортировки ленты: сначала новые посты, при совпадении
+# даты публикации порядок фиксирует id.
+CURSOR_ORDERING = ('-pub_date', '-pk')
+# Лента подписок сортируется по копиям этих полей в TimelineEntry,
+# см. timeline.follow_feed().
+TIMELINE_ORDERING = ('-feed_date', '-feed_pk')
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(obj, field='pub_date'):
+    """Упаковывает (дата, id) объекта в непрозрачный токен для URL."""
+    raw = f'{getattr(obj, field).isoformat()}|{obj.pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Распаковывает токен обратно в пару (дата, id)."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        date, pk = raw.rsplit('|', 1)
+        date = parse_datetime(date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(token)
+    if date is None:
+        raise InvalidCursor(token)
+    return date, pk
+
+
+class CursorPage(Page):
+    """
+    Страница, полученная по курсору. Номер страницы неизвестен,
+    поэтому соседние страницы определяются при выборке, без COUNT(*).
+    """
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        super().__init__(object_list, None, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<Cursor page>'
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_page_number(self):
+        return None
+
+    def previous_page_number(self):
+        return None
+
+    def start_index(self):
+        return None
+
+    def end_index(self):
+        return None
+
+
+class CursorPaginator(Paginator):
+    """
+    Паджинатор ленты постов по ключу (pub_date, id).
+    Подклассы задают другое поле даты через cursor_field.
+
+    Обычные ?page=N продолжают работать как раньше, а переходы
+    ?after=<токен> / ?before=<токен> выбирают соседнюю страницу
+    по индексу, без OFFSET и без подсчета всех строк.
+    Итог для номерной навигации берется из count_provider, если он
+    передан, и вызывается только когда номера страниц действительно нужны.
+    """
+
+    cursor_field = 'pub_date'
+    cursor_pk = 'pk'
+
+    def __init__(self, object_list, per_page, count_provider=None,
+                 **kwargs):
+        super().__init__(
+            object_list.order_by(
+                f'-{self.cursor_field}', f'-{self.cursor_pk}'
+            ),
+            per_page,
+            **kwargs
+        )
+        self.count_provider = count_provider
+
+    @cached_property
+    def count(self):
+        if self.count_provider is not None:
+            return self.count_provider()
+        return super().count
+
+    def get_page_from_request(self, request):
+        after = request.GET.get('after')
+        before = request.GET.get('before')
+        try:
+            if after:
+                return self.page_after(after)
+            if before:
+                return self.page_before(before)
+        except InvalidCursor:
+            pass
+        return self.get_page(request.GET.get('page'))
+
+    def encode_cursor(self, obj):
+        return encode_cursor(obj, self.cursor_field)
+
+    def _slice(self, object_list):
+        return list(object_list[:self.per_page + 1])
+
+    def first_page(self):
+        """Первая страница без подсчета всех строк."""
+        objects = self._slice(self.object_list)
+        has_next = len(objects) > self.per_page
+        return CursorPage(objects[:self.per_page], self, has_next, False)
+
+    def page_after(self, token):
+        """Страница объектов, которые старше объекта из токена."""
+        date, pk = decode_cursor(token)
+        field, pk_field = self.cursor_field, self.cursor_pk
+        objects = self._slice(self.object_list.filter(
+            Q(**{f'{field}__lt': date})
+            | Q(**{field: date, f'{pk_field}__lt': pk})
+        ))
+        has_next = len(objects) > self.per_page
+        return CursorPage(objects[:self.per_page], self, has_next, True)
+
+    def page_before(self, token):
+        """Страница объектов, которые новее объекта из токена."""
+        date, pk = decode_cursor(token)
+        field, pk_field = self.cursor_field, self.cursor_pk
+        objects = self._slice(self.object_list.filter(
+            Q(**{f'{field}__gt': date})
+            | Q(**{field: date, f'{pk_field}__gt': pk})
+        ).reverse())
+        has_previous = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        objects.reverse()
+        return CursorPage(objects, self, True, has_previous)
+
+
+class CommentPaginator(CursorPaginator):
+    """Комментарии поста пачками по ключу (created, id)."""
+
+    cursor_field = 'created'
+
+
+class TimelinePaginator(CursorPaginator):
+    """Лента подписок по индексу TimelineEntry (feed_date, feed_pk)."""
+
+    cursor_field = 'feed_date'
+    cursor_pk = 'feed_pk'
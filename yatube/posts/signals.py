@@ -0,0 +1,145 @@
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save
+)
+from django.core.signals import request_started
+from django.dispatch import receiver
+
+from core import page_cache
+
+from . import (
+    cards, counters, fragments, images, storage, thumbnails, timeline
+)
+from .models import Comment, Follow, Group, Post, User
+
+
+@receiver(pre_save, sender=Post)
+def remember_group(sender, instance, **kwargs):
+    # При редактировании пост может сменить группу, запоминаем старую,
+    # по прежней дате изменения находятся его старые карточки,
+    # а у прежней картинки нужно забрать ссылку
+    if instance._state.adding:
+        return
+    (instance._previous_group_id, instance._previous_updated,
+     instance._previous_image) = (
+        Post.objects.filter(pk=instance.pk)
+        .values_list('group_id', 'updated', 'image').first()
+        or (None, None, '')
+    )
+
+
+@receiver(pre_save, sender=Post)
+def fill_image_metadata(sender, instance, **kwargs):
+    # Только что загруженный файл еще не сохранен в хранилище:
+    # читаем его заголовок, пока он под рукой
+    if not instance.image:
+        metadata = images.empty_metadata()
+    elif not instance.image._committed:
+        metadata = images.image_metadata(instance.image)
+    else:
+        return
+    for field, value in metadata.items():
+        setattr(instance, field, value)
+    # Заглушка и варианты прежней картинки новой не подходят, их
+    # построит пул: запрос не декодирует картинку целиком
+    instance.image_placeholder = ''
+    instance.image_variants = ''
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(counters.post_keys(instance))
+        counters.increment_author(instance.author_id)
+        timeline.push_post(instance)
+        fragments.bump_post(instance)
+        storage.retain(instance.image.name)
+        return
+    previous_image = getattr(instance, '_previous_image', '')
+    if previous_image != instance.image.name:
+        storage.retain(instance.image.name)
+        storage.release(previous_image)
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    cards.purge_cards(
+        [(instance.pk, getattr(instance, '_previous_updated', None))]
+    )
+    fragments.bump_post(instance, previous_group_id)
+    if previous_group_id != instance.group_id:
+        if previous_group_id is not None:
+            counters.increment(
+                [counters.group_key(previous_group_id)], -1
+            )
+        if instance.group_id is not None:
+            counters.increment([counters.group_key(instance.group_id)])
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.increment(counters.post_keys(instance), -1)
+    counters.increment_author(instance.author_id, -1)
+    cards.purge_cards([(instance.pk, instance.updated)])
+    fragments.bump_post(instance)
+    storage.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    # Комментарии видны только на странице поста, ленты от них
+    # не меняются
+    page_cache.purge_tags(fragments.post_tag(instance.post_id))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill(instance.user_id, instance.author_id)
+        timeline.follow_changed(instance.author_id)
+        fragments.bump_many([
+            fragments.follow_feed(instance.user_id),
+            fragments.author_feed(instance.author_id),
+        ])
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    timeline.prune(instance.user_id, instance.author_id)
+    fragments.bump_many([
+        fragments.follow_feed(instance.user_id),
+        fragments.author_feed(instance.author_id),
+    ])
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # Адрес группы выводится в закэшированных карточках ее постов
+    # и во всех лентах, где они есть. Удаление группы обнуляет
+    # post.group одним UPDATE без сигналов, поэтому ленты сбрасываются
+    # здесь, пока посты группы еще можно найти.
+    posts = list(instance.posts.values_list('pk', 'updated', 'author_id'))
+    cards.purge_cards((pk, updated) for pk, updated, _ in posts)
+    fragments.bump_group(
+        instance.pk, (author_id for _, _, author_id in posts)
+    )
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields=None,
+                   **kwargs):
+    # Имя автора выводится в шапке профиля и в карточках его постов.
+    # Вход пользователя обновляет только last_login, от этого они
+    # не меняются.
+    if not created and update_fields != frozenset({'last_login'}):
+        posts = list(
+            instance.posts.values_list('pk', 'updated', 'group_id')
+        )
+        cards.purge_cards((pk, updated) for pk, updated, _ in posts)
+        fragments.bump_author(
+            instance.pk, (group_id for _, _, group_id in posts)
+        )
+
+
+# Найденные за запрос миниатюры не переживают его
+request_started.connect(
+    thumbnails.reset_memo, dispatch_uid='posts_thumbnail_memo'
+)
@@ -0,0 +1,123 @@
+"""
+Хранилище картинок постов, адресуемое содержимым.
+
+Файл называется SHA-256 своих байтов: posts/ab/abcd…ef.jpg. Одинаковые
+загрузки получают одно имя, поэтому хранятся один раз, а миниатюры
+и варианты (они строятся по имени и хэшу) у них тоже общие. Сколько
+постов ссылается на файл, считает StoredImage; файл удаляется вместе
+с последней ссылкой.
+"""
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+from .images import file_hash, variant_directory
+
+# Одно и то же расширение для одинаковых файлов с разными именами
+EXTENSIONS = {'.jpeg': '.jpg', '.jpe': '.jpg'}
+HASHED_NAME = re.compile(r'(?:^|/)([0-9a-f]{2})/(\1[0-9a-f]{62})(?:\.\w+)?$')
+
+
+def hashed_name(name, digest):
+    directory, filename = posixpath.split(name)
+    extension = posixpath.splitext(filename)[1].lower()
+    extension = EXTENSIONS.get(extension, extension)
+    return posixpath.join(directory, digest[:2], digest + extension)
+
+
+def name_hash(name):
+    """Хэш из имени адресуемого файла или None для старых имен."""
+    found = HASHED_NAME.search(name)
+    return found and found.group(2)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(name, file_hash(content)[0])
+        if self.exists(name):
+            return name
+        # Файл пишется под временным именем и переименовывается
+        # на место: если такой же файл параллельно сохраняет другой
+        # запрос, одинаковые байты просто заменят друг друга, а не
+        # появится копия с суффиксом, которую никто не считает
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            os.chmod(temporary, self.file_permissions_mode or 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return name
+
+
+image_storage = ContentAddressedStorage()
+
+
+def retain(name):
+    """
+    Еще один пост ссылается на файл. Считаются только имена по хэшу:
+    старые файлы переводит на них команда dedup_images.
+    """
+    from .models import StoredImage
+
+    if not name or not name_hash(name):
+        return
+    if StoredImage.objects.filter(name=name).update(refs=F('refs') + 1):
+        return
+    try:
+        with transaction.atomic():
+            StoredImage.objects.create(name=name, refs=1)
+    except IntegrityError:
+        # Запись успел создать параллельный запрос
+        StoredImage.objects.filter(name=name).update(refs=F('refs') + 1)
+
+
+def release(name):
+    """
+    Пост больше не ссылается на файл. Последняя ссылка удаляет
+    файл, его миниатюры и варианты после фиксации транзакции.
+    """
+    from .models import StoredImage
+
+    if not name or not name_hash(name):
+        return
+    StoredImage.objects.filter(name=name, refs__gt=0).update(
+        refs=F('refs') - 1
+    )
+    if StoredImage.objects.filter(name=name, refs=0).delete()[0]:
+        transaction.on_commit(lambda: delete_files(name))
+
+
+def delete_files(name):
+    from sorl.thumbnail import default
+    from sorl.thumbnail.images import ImageFile
+
+    from .models import StoredImage
+
+    # Файл могли загрузить снова, пока транзакция не зафиксировалась
+    if StoredImage.objects.filter(name=name).exists():
+        return
+    default.backend.delete(ImageFile(name, image_storage), delete_file=False)
+    image_storage.delete(name)
+    directory = variant_directory(name_hash(name))
+    if default_storage.exists(directory):
+        for filename in default_storage.listdir(directory)[1]:
+            default_storage.delete(f'{directory}/{filename}')
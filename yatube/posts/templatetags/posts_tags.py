@@ -0,0 +1,74 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from .. import images, thumbnails
+from ..cards import render_cards
+
+register = template.Library()
+
+
+@register.filter
+def after_cursor(page):
+    """Токен для перехода на следующую (более старую) страницу."""
+    if not hasattr(page.paginator, 'encode_cursor') or not len(page):
+        return ''
+    return page.paginator.encode_cursor(page[len(page) - 1])
+
+
+@register.filter
+def before_cursor(page):
+    """Токен для перехода на предыдущую (более новую) страницу."""
+    if not hasattr(page.paginator, 'encode_cursor') or not len(page):
+        return ''
+    return page.paginator.encode_cursor(page[0])
+
+
+@register.simple_tag
+def post_cards(page, variant='feed'):
+    """Карточки постов страницы из кэша, см. posts.cards."""
+    return render_cards(page, variant)
+
+
+@register.simple_tag
+def ready_thumbnail(image, geometry):
+    """Готовая миниатюра или None, см. posts.thumbnails."""
+    return thumbnails.ready(image, geometry)
+
+
+@register.inclusion_tag('posts/includes/post_image.html')
+def responsive_image(post, lazy=True):
+    """
+    Картинка поста: <picture> с вариантами из posts.images, а пока
+    их нет — готовая миниатюра или оригинал. До загрузки на месте
+    картинки виден фон из заглушки, размеры заданы заранее.
+    """
+    manifest = images.load_manifest(post.image_variants)
+    sources = [
+        {
+            'type': images.MIME_TYPES[image_format],
+            'srcset': ', '.join(
+                f'{default_storage.url(name)} {width}w'
+                for width, _, name, _ in manifest[image_format]
+            ),
+        }
+        for image_format in manifest if image_format != 'JPEG'
+    ]
+    fallback = None
+    if manifest.get('JPEG'):
+        width, height, name, _ = manifest['JPEG'][-1]
+        fallback = {
+            'src': default_storage.url(name),
+            'srcset': ', '.join(
+                f'{default_storage.url(name)} {width}w'
+                for width, _, name, _ in manifest['JPEG']
+            ),
+            'width': width,
+            'height': height,
+        }
+    return {
+        'post': post,
+        'lazy': lazy,
+        'sources': sources,
+        'fallback': fallback,
+        'sizes': images.VARIANT_SIZES,
+    }
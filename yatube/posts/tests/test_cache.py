@@ -1,9 +1,18 @@
+from http import HTTPStatus
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from posts.models import Post, Group
+from core.page_cache import AnonymousPageCacheMiddleware
+from posts.cards import card_key, render_cards
+from posts.models import Comment, Follow, Post, Group
 
 
 User = get_user_model()
@@ -38,7 +47,8 @@ class CacheTests(TestCase):
         response = self.guest_client.get(url)
         cached_response_content = response.content
 
-        post.delete()
+        # update() не шлет сигналов, поэтому страница остается в кэше
+        Post.objects.filter(pk=post.pk).update(text='changed')
 
         response = self.guest_client.get(url)
         self.assertEqual(cached_response_content, response.content)
@@ -47,3 +57,275 @@ class CacheTests(TestCase):
 
         response = self.guest_client.get(url)
         self.assertNotEqual(cached_response_content, response.content)
+
+    def test_feed_cache_invalidated_by_events(self):
+        """
+        Posts: Правка и удаление поста сбрасывают закэшированные
+        страницы index и group_list, а комментарий их не трогает.
+        """
+        post = Post.objects.create(
+            text='test',
+            author=self.user,
+            group=self.group
+        )
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                cached = self.guest_client.get(url).content
+                Comment.objects.create(
+                    post=post, author=self.user, text='comment'
+                )
+                self.assertEqual(cached, self.guest_client.get(url).content)
+                post.text = url
+                post.save()
+                self.assertNotEqual(
+                    cached, self.guest_client.get(url).content
+                )
+
+        cached = self.guest_client.get(urls[0]).content
+        post.delete()
+        self.assertNotEqual(cached, self.guest_client.get(urls[0]).content)
+
+    def test_post_cards_cached_and_invalidated(self):
+        """
+        Posts: Карточки страницы читаются из кэша одним get_many,
+        редактирование поста сбрасывает его карточку.
+        """
+        post = Post.objects.create(
+            text='card_text', author=self.user, group=self.group
+        )
+        posts = list(Post.objects.all())
+        render_cards(posts)
+        key = card_key(post.pk, post.updated, 'feed')
+        self.assertIn('card_text', cache.get(key))
+        with mock.patch.object(
+            cache, 'get_many', wraps=cache.get_many
+        ) as get_many, mock.patch(
+            'posts.cards.render_to_string'
+        ) as render:
+            self.assertIn('card_text', render_cards(posts)[0])
+        get_many.assert_called_once()
+        render.assert_not_called()
+
+        post.text = 'edited_text'
+        post.save()
+        self.assertIsNone(cache.get(key))
+        self.assertIn('edited_text', render_cards([post])[0])
+        post.delete()
+        self.assertIsNone(cache.get(card_key(post.pk, post.updated, 'feed')))
+
+    def test_author_rename_purges_cards(self):
+        """Posts: Смена имени автора сбрасывает карточки его постов."""
+        post = Post.objects.create(text='card_text', author=self.user)
+        render_cards([post])
+        key = card_key(post.pk, post.updated, 'feed')
+        self.assertIsNotNone(cache.get(key))
+
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.assertIsNone(cache.get(key))
+
+    def test_author_and_group_changes_reach_feeds(self):
+        """
+        Posts: Смена имени автора и адреса группы, а также удаление
+        группы видны на закэшированной главной и гостю, и читателю.
+        """
+        author = User.objects.create(username='renamed', first_name='Old')
+        group = Group.objects.create(title='Коты', slug='cats')
+        Post.objects.create(text='card_text', author=author, group=group)
+        reader = Client()
+        reader.force_login(User.objects.create(username='reader'))
+        url = reverse('posts:index')
+        for client in (self.guest_client, reader):
+            client.get(url)
+
+        author.first_name = 'New'
+        author.save()
+        group.slug = 'dogs'
+        group.save()
+        for client in (self.guest_client, reader):
+            with self.subTest(client=client):
+                content = client.get(url).content.decode()
+                self.assertIn('New', content)
+                self.assertNotIn('Old', content)
+                self.assertIn('/group/dogs/', content)
+
+        group.delete()
+        for client in (self.guest_client, reader):
+            with self.subTest(client=client):
+                self.assertNotIn('/group/', client.get(url).content.decode())
+
+    def test_feed_cache_varies_on_page(self):
+        """Posts: Разные страницы ленты кэшируются под разными ключами."""
+        Post.objects.bulk_create(
+            Post(text=f'post {i}', author=self.user) for i in range(12)
+        )
+        cache.clear()
+        url = reverse('posts:index')
+        first = self.guest_client.get(url).content
+        second = self.guest_client.get(url, {'page': 2}).content
+        self.assertNotEqual(first, second)
+
+    def test_follow_cache_is_per_user(self):
+        """
+        Posts: Лента подписок кэшируется для каждого пользователя
+        отдельно и сбрасывается новым постом автора и подпиской.
+        """
+        author = User.objects.create(username='author')
+        follower = User.objects.create(username='follower')
+        reader = User.objects.create(username='reader')
+        Follow.objects.create(user=follower, author=author)
+        follower_client = Client()
+        follower_client.force_login(follower)
+        reader_client = Client()
+        reader_client.force_login(reader)
+        url = reverse('posts:follow_index')
+
+        reader_page = reader_client.get(url).content
+        follower_client.get(url)
+        Post.objects.create(text='fresh_post', author=author)
+        self.assertContains(follower_client.get(url), 'fresh_post')
+        self.assertEqual(reader_page, reader_client.get(url).content)
+
+        reader_client.get(
+            reverse('posts:profile_follow', kwargs={'username': 'author'})
+        )
+        self.assertContains(reader_client.get(url), 'fresh_post')
+
+    def test_post_purges_author_generation_only(self):
+        """
+        Posts: Пост сбрасывает поколение автора, а не ключ на каждого
+        подписчика, комментарий ленты не сбрасывает.
+        """
+        author = User.objects.create(username='popular')
+        for number in range(5):
+            Follow.objects.create(
+                user=User.objects.create(username=f'fan_{number}'),
+                author=author
+            )
+        with mock.patch('posts.fragments.purge') as purge:
+            post = Post.objects.create(text='post', author=author)
+        keys = list(purge.call_args[0][0])
+        self.assertIn(f'feed_generation:author:{author.pk}', keys)
+        self.assertFalse([key for key in keys if 'follow:' in key])
+
+        with mock.patch('posts.fragments.purge') as purge:
+            Comment.objects.create(post=post, author=author, text='!')
+        purge.assert_not_called()
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='page_author')
+        cls.group = Group.objects.create(
+            title='Page_group', slug='page_slug', description='-'
+        )
+        cls.post = Post.objects.create(
+            text='page_post', author=cls.author, group=cls.group
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+
+    def test_anonymous_pages_served_from_cache(self):
+        """
+        Posts: Повторный анонимный запрос отдается из кэша страниц
+        без обращений к базе, авторизованный — нет.
+        """
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertIn('Surrogate-Key', response)
+                with self.assertNumQueries(0):
+                    cached = self.guest_client.get(url)
+                self.assertEqual(response.content, cached.content)
+
+        user_client = Client()
+        user_client.force_login(self.author)
+        user_client.get(self.urls[0])
+        with CaptureQueriesContext(connection) as queries:
+            user_client.get(self.urls[0])
+        self.assertTrue(queries.captured_queries)
+
+    def test_purged_page_is_not_served_stale(self):
+        """
+        Posts: Удаленный пост не отдается из кэша страниц, даже пока
+        его пересчитывает другой запрос.
+        """
+        post = Post.objects.create(text='doomed_post', author=self.author)
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        self.assertContains(self.guest_client.get(url), 'doomed_post')
+        post.delete()
+        with mock.patch('core.stampede.acquire', return_value=False):
+            response = self.guest_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(
+            self.guest_client.get(url).status_code, HTTPStatus.NOT_FOUND
+        )
+
+    def test_page_key_varies_on_host(self):
+        """Posts: Одна и та же страница разных хостов кэшируется отдельно."""
+        middleware = AnonymousPageCacheMiddleware(None)
+        factory = RequestFactory()
+        self.assertNotEqual(
+            middleware.cache_key(factory.get('/', HTTP_HOST='localhost')),
+            middleware.cache_key(factory.get('/', HTTP_HOST='127.0.0.1'))
+        )
+
+    @override_settings(ALLOWED_HOSTS=['.example.com', 'testserver'])
+    def test_warm_cache_command(self):
+        """
+        Posts: После warm_cache страницы отдаются из кэша запросам
+        к прогретому хосту.
+        """
+        out = StringIO()
+        call_command('warm_cache', workers=1, stdout=out)
+        self.assertIn('ошибок: 0', out.getvalue())
+        # По умолчанию прогревается первый хост из ALLOWED_HOSTS
+        client = Client(HTTP_HOST='example.com')
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertIn(url, out.getvalue())
+                with self.assertNumQueries(0):
+                    client.get(url)
+
+        call_command('warm_cache', workers=1, host='testserver',
+                     stdout=StringIO())
+        with self.assertNumQueries(0):
+            self.guest_client.get(self.urls[0])
+
+    def test_pages_purged_by_tags(self):
+        """
+        Posts: Новый пост сбрасывает ленты, комментарий — страницу
+        поста, правка группы — страницу группы.
+        """
+        for url in self.urls:
+            self.guest_client.get(url)
+        Post.objects.create(
+            text='fresh_page_post', author=self.author, group=self.group
+        )
+        for url in self.urls[:2]:
+            with self.subTest(url=url):
+                self.assertContains(self.guest_client.get(url),
+                                    'fresh_page_post')
+
+        Comment.objects.create(
+            post=self.post, author=self.author, text='fresh_comment'
+        )
+        self.assertContains(self.guest_client.get(self.urls[2]),
+                            'fresh_comment')
+
+        self.group.title = 'Renamed_group'
+        self.group.save()
+        self.assertContains(self.guest_client.get(self.urls[1]),
+                            'Renamed_group')
@@ -0,0 +1,101 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from posts import counters
+from posts.models import AuthorStats, FeedCounter, Follow, Group, Post
+
+
+User = get_user_model()
+
+
+class FeedCounterTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.group = Group.objects.create(
+            title='Test_group',
+            slug='test_group',
+            description='Test_description'
+        )
+        cls.other_group = Group.objects.create(
+            title='Other_group',
+            slug='other_group',
+            description='Other_description'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def test_counters_follow_create_and_delete(self):
+        """Posts: Итоги лент меняются при создании и удалении поста."""
+        Post.objects.create(text='first', author=self.author)
+        feeds = {
+            counters.index_count: 1,
+            lambda: counters.group_count(self.group): 0,
+            lambda: counters.author_count(self.author): 1,
+            lambda: counters.follow_count(self.reader): 1,
+        }
+        for provider, expected in feeds.items():
+            with self.subTest(expected=expected):
+                self.assertEqual(provider(), expected)
+
+        post = Post.objects.create(
+            text='second', author=self.author, group=self.group
+        )
+        # Повторное чтение берется из счетчика, без COUNT(*) по постам
+        with self.assertNumQueries(1):
+            self.assertEqual(counters.index_count(), 2)
+        self.assertEqual(counters.group_count(self.group), 1)
+        self.assertEqual(counters.follow_count(self.reader), 2)
+
+        post.group = self.other_group
+        post.save()
+        self.assertEqual(counters.group_count(self.group), 0)
+        self.assertEqual(counters.group_count(self.other_group), 1)
+
+        post.delete()
+        self.assertEqual(counters.author_count(self.author), 1)
+        self.assertEqual(counters.group_count(self.other_group), 0)
+        self.assertEqual(
+            FeedCounter.objects.get(key=counters.INDEX).value, 1
+        )
+
+    def test_drifted_counters_are_logged(self):
+        """
+        Posts: Удаление поста при разошедшемся счетчике пишет
+        предупреждение, а итог ленты пересчитывается заново.
+        """
+        post = Post.objects.create(text='first', author=self.author)
+        self.assertEqual(counters.index_count(), 1)
+        self.assertEqual(counters.author_count(self.author), 1)
+        FeedCounter.objects.filter(key=counters.INDEX).update(value=0)
+        AuthorStats.objects.filter(user=self.author).update(posts_count=0)
+
+        with self.assertLogs('posts.counters', 'WARNING') as logs:
+            post.delete()
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(counters.index_count(), 0)
+
+    def test_author_stats_cascade_and_reconcile(self):
+        """
+        Posts: Число постов автора читается без COUNT(*), а команда
+        reconcile_post_counts исправляет расхождения.
+        """
+        author = User.objects.create(username='gone')
+        Post.objects.create(text='first', author=author)
+        Post.objects.create(text='second', author=author)
+        self.assertEqual(counters.author_count(author), 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(counters.author_count(author), 2)
+
+        AuthorStats.objects.filter(user=author).update(posts_count=7)
+        out = StringIO()
+        call_command('reconcile_post_counts', stdout=out)
+        self.assertIn('исправлено: 1', out.getvalue())
+        self.assertEqual(counters.author_count(author), 2)
+
+        author.delete()
+        self.assertFalse(AuthorStats.objects.filter(user_id=author.pk))
@@ -1,15 +1,28 @@
 import shutil
+import struct
 import tempfile
+import zlib
+from io import BytesIO
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 from ..models import Post, Group
 
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -177,3 +190,44 @@ class PostFormTests(TestCase):
         response = self.guest_client.get(post_page)
         first_comment = response.context['comments'][0]
         self.assertEqual(first_comment, post.comments.get(text='Test_comment'))
+
+    def test_large_uploads_rejected(self):
+        """
+        Forms: Файл больше FILE_UPLOAD_MAX_SIZE и картинка с лишними
+        пикселями отклоняются, пост не создается.
+        """
+        def chunk(kind, data):
+            return (struct.pack('>I', len(data)) + kind + data
+                    + struct.pack('>I', zlib.crc32(kind + data)))
+
+        # Заголовок PNG 8000x8000 без самих пикселей
+        bomb = (
+            b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', 8000, 8000, 8, 0,
+                                         0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b''))
+            + chunk(b'IEND', b'')
+        )
+        bmp = BytesIO()
+        Image.new('RGB', (1, 1)).save(bmp, 'BMP')
+        cases = (
+            ('big.gif', GIF, 'file_too_large', {'FILE_UPLOAD_MAX_SIZE': 10}),
+            ('bomb.png', bomb, 'too_many_pixels', {}),
+            ('image.bmp', bmp.getvalue(), 'invalid_format', {}),
+            ('fake.png', b'not an image', 'invalid_image', {}),
+        )
+        posts_count = Post.objects.count()
+        for name, content, code, limits in cases:
+            with self.subTest(name=name), self.settings(**limits):
+                response = self.authorized_client.post(
+                    reverse('posts:post_create'),
+                    {
+                        'text': 'Пост с большой картинкой',
+                        'image': SimpleUploadedFile(name, content),
+                    }
+                )
+                form = response.context['form']
+                self.assertEqual(
+                    form.errors.as_data()['image'][0].code, code
+                )
+        self.assertEqual(Post.objects.count(), posts_count)
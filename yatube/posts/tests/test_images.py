@@ -0,0 +1,533 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default
+
+from .. import images, storage, thumbnails
+from ..cards import render_cards
+from ..management.commands import dedup_images, rebuild_thumbnails
+from ..feeds import feed_posts
+from ..models import Post, StoredImage
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+# Та же картинка с другой палитрой: другие байты и другой хэш
+OTHER_GIF = SMALL_GIF.replace(b'\xFF\xFF\xFF', b'\x00\x00\xFF')
+
+
+def uploaded_gif(name='image.gif', content=SMALL_GIF):
+    return SimpleUploadedFile(
+        name=name, content=content, content_type='image/gif'
+    )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='thumbnail_author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_original_shown_until_thumbnail_ready(self):
+        """
+        Posts: Пока миниатюры нет, страницы показывают оригинал,
+        после генерации — миниатюру.
+        """
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=uploaded_gif()
+        )
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        ]
+        with mock.patch.object(thumbnails, 'generate') as generate:
+            for url in urls:
+                self.assertContains(self.client.get(url), post.image.url)
+        # В тестах транзакция не фиксируется, очередь не запускается
+        generate.assert_not_called()
+
+        thumbnails.generate(post.image.name)
+        thumbnail = default.backend.lookup(
+            post.image, '960x339', **thumbnails.SIZES['960x339']
+        )
+        self.assertIsNotNone(thumbnail)
+        # Миниатюра нужна постам, для которых еще нет вариантов
+        Post.objects.update(image_variants='')
+        cache.clear()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), thumbnail.url)
+
+    def test_upload_enqueues_thumbnails(self):
+        """Posts: post_create и post_edit ставят миниатюры в очередь."""
+        with mock.patch.object(thumbnails, 'enqueue') as enqueue:
+            self.client.post(reverse('posts:post_create'), {
+                'text': 'Новый пост', 'image': uploaded_gif('new.gif'),
+            })
+            post = Post.objects.get(text='Новый пост')
+            enqueue.assert_called_once_with(post.image.name)
+
+            enqueue.reset_mock()
+            self.client.post(
+                reverse('posts:post_edit', kwargs={'post_id': post.pk}),
+                {'text': 'Без новой картинки'}
+            )
+            enqueue.assert_not_called()
+
+    def test_pool_failures_are_logged(self):
+        """Posts: Ошибка построения миниатюр в пуле попадает в лог."""
+        future = Future()
+        future.set_exception(OSError('disk full'))
+        with self.assertLogs('posts.thumbnails', 'ERROR'):
+            thumbnails._log_failure('posts/broken.gif', future)
+
+    def test_page_thumbnails_resolved_in_one_lookup(self):
+        """
+        Posts: Миниатюры страницы ищутся одним get_many кэша
+        и одним запросом к базе, а не тегом на каждый пост.
+        """
+        for number in range(5):
+            post = Post.objects.create(
+                text=f'Пост {number}', author=self.user,
+                image=uploaded_gif(f'page_{number}.gif')
+            )
+            thumbnails.generate(post.image.name)
+        Post.objects.update(image_variants='')
+        posts = list(feed_posts())
+        cache.clear()
+        thumbnails.reset_memo()
+        with mock.patch.object(
+            cache, 'get_many', wraps=cache.get_many
+        ) as get_many, self.assertNumQueries(1):
+            rendered = render_cards(posts)
+        # Один раз для карточек, один раз для миниатюр
+        self.assertEqual(get_many.call_count, 2)
+        for post, card in zip(posts, rendered):
+            self.assertNotIn(post.image.url, card)
+
+    def test_rebuild_checkpoint_ignores_planted_links(self):
+        """
+        Posts: Прогресс rebuild_thumbnails не пишется по заранее
+        подложенной ссылке на чужой файл.
+        """
+        directory = tempfile.mkdtemp(dir=TEMP_MEDIA_ROOT)
+        victim = os.path.join(directory, 'victim')
+        with open(victim, 'w') as file:
+            file.write('secret')
+        checkpoint = os.path.join(directory, 'rebuild.json')
+        os.symlink(victim, f'{checkpoint}.tmp')
+        rebuild_thumbnails.Command().save(checkpoint, {'done': 1})
+        with open(victim) as file:
+            self.assertEqual(file.read(), 'secret')
+        with open(checkpoint) as file:
+            self.assertEqual(json.load(file), {'done': 1})
+
+    def test_rebuild_thumbnails_resumes_from_checkpoint(self):
+        """
+        Posts: rebuild_thumbnails продолжает с сохраненного места,
+        пишет миниатюры в KV-хранилище и удаляет прогресс в конце.
+        """
+        posts = [
+            Post.objects.create(
+                text=f'Пост {number}', author=self.user,
+                image=uploaded_gif(f'rebuild_{number}.gif', content)
+            )
+            for number, content in enumerate((
+                SMALL_GIF, OTHER_GIF,
+                SMALL_GIF.replace(b'\xFF\xFF\xFF', b'\x10\x20\x30'),
+            ))
+        ]
+        posts.sort(key=lambda post: post.image.name)
+        checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'rebuild.json')
+        with open(checkpoint, 'w') as file:
+            json.dump({
+                'sizes': thumbnails.SIZES, 'last': posts[0].image.name,
+                'done': 1, 'created': 1, 'missing': 0,
+            }, file)
+
+        out = StringIO()
+        call_command(
+            'rebuild_thumbnails', workers=0, batch_size=1,
+            checkpoint=checkpoint, stdout=out
+        )
+        # Миниатюры этих файлов могли остаться от других тестов
+        self.assertIn('Готово: 3 картинок', out.getvalue())
+        self.assertIn('изобр./с на ядро', out.getvalue())
+        self.assertFalse(os.path.exists(checkpoint))
+        found = [
+            default.backend.lookup(
+                post.image, '960x339', **thumbnails.SIZES['960x339']
+            )
+            for post in posts
+        ]
+        self.assertIsNone(found[0])
+        self.assertIsNotNone(found[1])
+        self.assertIsNotNone(found[2])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ResponsiveImageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='variants_author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_variants_built_and_rendered_as_srcset(self):
+        """
+        Posts: Пул строит варианты в WebP и JPEG, а страницы выводят
+        их через <picture> с srcset и sizes.
+        """
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=uploaded_gif('wide.gif')
+        )
+        thumbnails.generate(post.image.name)
+        post.refresh_from_db()
+        manifest = images.load_manifest(post.image_variants)
+        self.assertIn('JPEG', manifest)
+        self.assertIn('WEBP', manifest)
+        for image_format, variants in manifest.items():
+            for width, height, name, size in variants:
+                self.assertTrue(name.startswith(
+                    f'variants/{post.image_hash[:2]}/{post.image_hash}/'
+                ))
+                self.assertTrue(default_storage.exists(name))
+
+        response = Client().get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        )
+        webp_width, _, webp_name, _ = manifest['WEBP'][0]
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(
+            response, f'{default_storage.url(webp_name)} {webp_width}w'
+        )
+        self.assertContains(response, images.VARIANT_SIZES)
+        self.assertNotContains(response, post.image.url)
+
+    def test_new_upload_resets_variants(self):
+        """Posts: Новая картинка сбрасывает варианты прежней."""
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=uploaded_gif('first.gif')
+        )
+        thumbnails.generate(post.image.name)
+        post.refresh_from_db()
+        self.assertNotEqual(post.image_variants, '')
+
+        post.image = uploaded_gif('second.gif', OTHER_GIF)
+        post.save()
+        self.assertEqual(post.image_variants, '')
+
+    def test_variant_widths_not_upscaled(self):
+        self.assertEqual(images.variant_widths(700), [320, 480, 640])
+        self.assertEqual(images.variant_widths(100), [320])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class PlaceholderTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='placeholder_author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_placeholder_averages_cells(self):
+        """Posts: Клетки заглушки — средние цвета кадра 960x339."""
+        image = Image.new('RGB', (1920, 678), (255, 0, 0))
+        image.paste((0, 0, 255), (960, 0, 1920, 678))
+        buffer = BytesIO()
+        image.save(buffer, 'PNG')
+        data_uri = images.placeholder(
+            SimpleUploadedFile('halves.png', buffer.getvalue())
+        )
+        prefix = 'data:image/png;base64,'
+        self.assertTrue(data_uri.startswith(prefix))
+        with Image.open(
+            BytesIO(base64.b64decode(data_uri[len(prefix):]))
+        ) as cells:
+            self.assertEqual(cells.size, images.PLACEHOLDER_GRID)
+            self.assertEqual(cells.getpixel((0, 0)), (255, 0, 0))
+            self.assertEqual(cells.getpixel((15, 5)), (0, 0, 255))
+
+    def test_placeholder_shrinks_large_frames(self):
+        """
+        Posts: Большой PNG уменьшается до массива NumPy, заглушка
+        не строится по всем пикселям кадра.
+        """
+        buffer = BytesIO()
+        Image.new('RGB', (3000, 3000), (0, 128, 0)).save(buffer, 'PNG')
+        with mock.patch.object(
+            images.np, 'asarray', wraps=images.np.asarray
+        ) as asarray:
+            images.placeholder(
+                SimpleUploadedFile('big.png', buffer.getvalue())
+            )
+        frame = asarray.call_args[0][0]
+        self.assertLess(frame.width * frame.height, 3000 * 3000 // 100)
+
+    def test_placeholder_inlined_in_feed(self):
+        """
+        Posts: Заглушку строит пул миниатюр, а не запрос загрузки;
+        лента выводит ее фоном картинки, которая грузится лениво.
+        """
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=uploaded_gif('lqip.gif')
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.image_placeholder, '')
+        thumbnails.generate(post.image.name)
+        post.refresh_from_db()
+        self.assertTrue(post.image_placeholder.startswith('data:image/png'))
+        response = Client().get(reverse('posts:index'))
+        self.assertContains(response, post.image_placeholder)
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_backfill_placeholders(self):
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=uploaded_gif('old.gif')
+        )
+        same_file = Post.objects.create(
+            text='Копия', author=self.user, image=uploaded_gif('copy.gif')
+        )
+        expected = thumbnails.build_placeholder(post.image.name)
+        Post.objects.update(image_placeholder='')
+        out = StringIO()
+        call_command('backfill_placeholders', workers=0, stdout=out)
+        self.assertIn('Заполнено постов: 2, файлов не найдено: 0',
+                      out.getvalue())
+        for saved in (post, same_file):
+            saved.refresh_from_db()
+            self.assertEqual(saved.image_placeholder, expected)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ImageMetadataTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='metadata_author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def assert_metadata(self, post):
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_size,
+             post.image_format, post.image_hash),
+            (2, 1, len(SMALL_GIF), 'GIF',
+             hashlib.sha256(SMALL_GIF).hexdigest())
+        )
+
+    def test_metadata_saved_on_upload(self):
+        """Posts: Сведения о картинке сохраняются при загрузке."""
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=uploaded_gif('meta.gif')
+        )
+        post.refresh_from_db()
+        self.assert_metadata(post)
+
+        post.text = 'Правка без новой картинки'
+        with mock.patch('posts.images.Image.open') as image_open:
+            post.save()
+        image_open.assert_not_called()
+
+        post.image = None
+        post.save()
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_hash, '')
+
+    def test_backfill_image_metadata(self):
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=uploaded_gif('old.gif')
+        )
+        broken = Post.objects.create(
+            text='Пост', author=self.user,
+            image=uploaded_gif('lost.gif', OTHER_GIF)
+        )
+        broken.image.storage.delete(broken.image.name)
+        Post.objects.update(
+            image_width=None, image_height=None, image_size=None,
+            image_format='', image_hash=''
+        )
+        out = StringIO()
+        call_command('backfill_image_metadata', stdout=out)
+        self.assertIn('Заполнено: 1, файлов не найдено: 1', out.getvalue())
+        post.refresh_from_db()
+        self.assert_metadata(post)
+
+
+@override_settings(THUMBNAIL_WORKERS=0)
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='storage_author')
+
+    def setUp(self):
+        # Итоги dedup_images зависят от уже лежащих файлов, поэтому
+        # у каждого теста свой пустой MEDIA_ROOT
+        media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def refs(self, name):
+        return (StoredImage.objects.filter(name=name)
+                .values_list('refs', flat=True).first())
+
+    def test_identical_uploads_share_file(self):
+        """
+        Posts: Одинаковые картинки хранятся одним файлом с именем
+        по SHA-256, файл удаляется вместе с последней ссылкой.
+        """
+        first, second = [
+            Post.objects.create(
+                text='Мем', author=self.user, image=uploaded_gif(name)
+            )
+            for name in ('meme.gif', 'meme (1).GIF')
+        ]
+        digest = hashlib.sha256(SMALL_GIF).hexdigest()
+        name = f'posts/{digest[:2]}/{digest}.gif'
+        self.assertEqual(first.image.name, name)
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(self.refs(name), 2)
+
+        first.delete()
+        self.assertEqual(self.refs(name), 1)
+        second.image = uploaded_gif('other.gif', OTHER_GIF)
+        second.save()
+        self.assertIsNone(self.refs(name))
+        self.assertEqual(self.refs(second.image.name), 1)
+
+        # В тестах транзакция не фиксируется, удаляем как on_commit
+        self.assertTrue(storage.image_storage.exists(name))
+        storage.delete_files(name)
+        self.assertFalse(storage.image_storage.exists(name))
+
+    def test_racing_uploads_share_hashed_name(self):
+        """
+        Posts: Одинаковая картинка, которую параллельно сохраняют два
+        запроса, остается одним файлом с именем по хэшу.
+        """
+        first = storage.image_storage.save('race.gif', ContentFile(SMALL_GIF))
+        exists = storage.image_storage.exists
+        checked = []
+
+        def checked_before_first_write(name):
+            # Второй запрос проверил наличие файла до того, как его
+            # записал первый
+            if checked:
+                return exists(name)
+            checked.append(name)
+            return False
+
+        with mock.patch.object(
+            storage.image_storage, 'exists',
+            side_effect=checked_before_first_write
+        ):
+            second = storage.image_storage.save(
+                'race (1).gif', ContentFile(SMALL_GIF)
+            )
+        self.assertEqual(first, second)
+        directory = os.path.dirname(storage.image_storage.path(first))
+        self.assertEqual(os.listdir(directory), [os.path.basename(first)])
+
+    def test_dedup_images(self):
+        """Posts: dedup_images сливает загруженные раньше копии."""
+        legacy = FileSystemStorage()
+        names = [
+            legacy.save(f'posts/{name}', ContentFile(content))
+            for name, content in (
+                ('a.gif', SMALL_GIF), ('b.gif', SMALL_GIF),
+                ('c.gif', OTHER_GIF),
+            )
+        ]
+        posts = [Post.objects.create(text='Пост', author=self.user)
+                 for _ in names]
+        for post, name in zip(posts, names):
+            Post.objects.filter(pk=post.pk).update(image=name)
+
+        out = StringIO()
+        call_command('dedup_images', stdout=out)
+        self.assertIn(
+            'Перенесено: 2, слито дубликатов: 1', out.getvalue()
+        )
+        first, second, third = [
+            Post.objects.get(pk=post.pk).image.name for post in posts
+        ]
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, third)
+        self.assertEqual(self.refs(first), 2)
+        self.assertEqual(self.refs(third), 1)
+        for name in names:
+            self.assertFalse(legacy.exists(name))
+        self.assertTrue(legacy.exists(first))
+
+    def test_dedup_images_keeps_files_until_repointed(self):
+        """
+        Posts: Прерванная dedup_images не оставляет постов со ссылкой
+        на удаленный файл.
+        """
+        legacy = FileSystemStorage()
+        names = [
+            legacy.save(f'posts/{name}', ContentFile(SMALL_GIF))
+            for name in ('a.gif', 'b.gif')
+        ]
+        for name in names:
+            post = Post.objects.create(text='Пост', author=self.user)
+            Post.objects.filter(pk=post.pk).update(image=name)
+
+        with mock.patch.object(
+            dedup_images.Command, 'repoint', side_effect=KeyboardInterrupt
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('dedup_images', stdout=StringIO())
+        for post in Post.objects.filter(author=self.user):
+            self.assertTrue(legacy.exists(post.image.name))
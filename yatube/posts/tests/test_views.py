@@ -1,19 +1,24 @@
 import shutil
 import tempfile
+from io import StringIO
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django import forms
 from http import HTTPStatus
+from .. import timeline
 
-from ..models import Post, Group, Follow
+from ..models import Comment, Post, Group, Follow, TimelineEntry
+from ..paginators import encode_cursor
 
 # Чтобы при изменении количества постов для паджинатора сюда это
 # количество передавалось автоматом для теста паджинатора
-from ..views import POSTS
+from ..views import COMMENTS, POSTS
 
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -255,6 +260,44 @@ class PaginatorViewsTest(TestCase):
                 response = self.authorized_client.get(name)
                 self.assertEqual(len(response.context['page_obj']), POSTS)
 
+    def test_cursor_paginator(self):
+        """
+        Posts: Переходы ?after= / ?before= отдают соседние страницы ленты.
+        """
+        names = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': f'{self.group.slug}'}),
+            reverse('posts:profile', kwargs={
+                'username': f'{self.user.username}'
+            })
+        ]
+        for name in names:
+            with self.subTest(name=name):
+                first_page = list(
+                    self.authorized_client.get(name).context['page_obj']
+                )
+                after = encode_cursor(first_page[-1])
+                second_page = self.authorized_client.get(
+                    name, {'after': after}
+                ).context['page_obj']
+                self.assertEqual(len(second_page), 2)
+                self.assertFalse(second_page.has_next())
+                self.assertTrue(second_page.has_previous())
+
+                before = encode_cursor(second_page[0])
+                back_page = self.authorized_client.get(
+                    name, {'before': before}
+                ).context['page_obj']
+                self.assertEqual(list(back_page), first_page)
+                self.assertFalse(back_page.has_previous())
+
+    def test_cursor_paginator_bad_token(self):
+        """Posts: Испорченный курсор открывает первую страницу."""
+        response = self.authorized_client.get(
+            reverse('posts:index'), {'after': 'broken!'}
+        )
+        self.assertEqual(response.context['page_obj'].number, 1)
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostPagesWithImage(TestCase):
@@ -420,3 +463,288 @@ class FollowTests(TestCase):
         context_not_follower = response_not_follower.context['page_obj']
         self.assertIn(post, context_follower)
         self.assertNotIn(post, context_not_follower)
+
+    def test_following_backfill_and_prune(self):
+        """
+        Posts: Старые посты автора попадают в ленту после подписки
+        и исчезают из нее после отписки.
+        """
+        post = Post.objects.create(
+            text='Test_post',
+            author=self.author,
+            group=self.group,
+        )
+
+        self.follower_client.get(self.urls['follow'])
+        response = self.follower_client.get(self.urls['follow_index'])
+        self.assertIn(post, response.context['page_obj'])
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.follower, post=post)
+            .exists()
+        )
+
+        self.follower_client.get(self.urls['unfollow'])
+        response = self.follower_client.get(self.urls['follow_index'])
+        self.assertNotIn(post, response.context['page_obj'])
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.follower).exists()
+        )
+
+    @override_settings(CELEBRITY_FOLLOWERS=2)
+    def test_celebrity_posts_merged_on_read(self):
+        """
+        Posts: Посты популярного автора не раскладываются по лентам,
+        но попадают в ленту подписок при чтении в правильном порядке.
+        """
+        cache.clear()
+        normal_author = User.objects.create(username='normal_author')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=self.not_follower, author=self.author)
+        Follow.objects.create(user=self.follower, author=normal_author)
+
+        old_post = Post.objects.create(text='old', author=normal_author)
+        celebrity_post = Post.objects.create(text='hot', author=self.author)
+        new_post = Post.objects.create(text='new', author=normal_author)
+
+        self.assertFalse(
+            TimelineEntry.objects.filter(post=celebrity_post).exists()
+        )
+        response = self.follower_client.get(self.urls['follow_index'])
+        self.assertEqual(
+            list(response.context['page_obj']),
+            [new_post, celebrity_post, old_post]
+        )
+
+    @override_settings(CELEBRITY_FOLLOWERS=2, CELEBRITY_DEMOTE_FOLLOWERS=1)
+    def test_celebrity_demoted_by_command_with_hysteresis(self):
+        """
+        Posts: Отписка от популярного автора ничего не раскладывает,
+        автор между порогами остается популярным, а ниже нижнего порога
+        команда classify_celebrities раскладывает его посты по лентам.
+        """
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=self.not_follower, author=self.author)
+        post = Post.objects.create(text='hot', author=self.author)
+        self.assertTrue(timeline.is_celebrity(self.author.pk))
+
+        self.not_follower_client.get(self.urls['unfollow'])
+        out = StringIO()
+        call_command('classify_celebrities', stdout=out)
+        self.assertIn('переведены на раскладку: 0', out.getvalue())
+        self.assertTrue(timeline.is_celebrity(self.author.pk))
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        response = self.follower_client.get(self.urls['follow_index'])
+        self.assertIn(post, response.context['page_obj'])
+
+        with override_settings(CELEBRITY_DEMOTE_FOLLOWERS=2):
+            call_command('classify_celebrities', stdout=out)
+        self.assertIn('переведены на раскладку: 1', out.getvalue())
+        self.assertFalse(timeline.is_celebrity(self.author.pk))
+        self.assertEqual(timeline.celebrities(), [])
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.follower, post=post)
+            .exists()
+        )
+        response = self.follower_client.get(self.urls['follow_index'])
+        self.assertIn(post, response.context['page_obj'])
+
+
+class CommentsPaginationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='commentator')
+        cls.post = Post.objects.create(text='Test_post', author=cls.user)
+        cls.other_post = Post.objects.create(text='Other', author=cls.user)
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.user, text=f'comment {i}')
+            for i in range(COMMENTS + 3)
+        )
+        Comment.objects.create(
+            post=cls.other_post, author=cls.user, text='foreign'
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_post_detail_shows_first_batch_of_own_comments(self):
+        """
+        Posts: На странице поста только его комментарии, первой пачкой.
+        """
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        response = self.guest_client.get(url)
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COMMENTS)
+        self.assertTrue(comments.has_next())
+        self.assertNotContains(response, 'foreign')
+
+    def test_next_comments_fragment(self):
+        """Posts: Фрагмент отдает следующую пачку комментариев."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        first = list(self.guest_client.get(url).context['comments'])
+        response = self.guest_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.id}),
+            {'after': encode_cursor(first[-1], 'created')}
+        )
+        self.assertTemplateUsed(response, 'posts/includes/comments.html')
+        rest = list(response.context['comments'])
+        self.assertEqual(len(rest), 3)
+        self.assertFalse(set(first) & set(rest))
+
+
+class FeedQueriesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username='reader')
+        cls.group = Group.objects.create(
+            title='test_group',
+            slug='test_slug',
+            description='description_of_test_group'
+        )
+        # Посты разных авторов: при N+1 число запросов
+        # росло бы вместе с количеством постов на странице
+        for i in range(POSTS):
+            author = User.objects.create(username=f'author_{i}')
+            Post.objects.create(
+                text='Test_post', author=author, group=cls.group
+            )
+            Follow.objects.create(user=cls.reader, author=author)
+        for i in range(POSTS):
+            Post.objects.create(
+                text='Test_post', author=cls.reader, group=cls.group
+            )
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_feed_query_count(self):
+        """Posts: Число запросов ленты не зависит от числа постов."""
+        # Сессия и пользователь — 2 запроса, у группы и профиля
+        # еще один уходит на ETag, остальное — сама лента
+        expected = {
+            reverse('posts:index'): 4,
+            reverse(
+                'posts:group_list', kwargs={'slug': self.group.slug}
+            ): 6,
+            reverse(
+                'posts:profile', kwargs={'username': self.reader.username}
+            ): 7,
+            reverse('posts:follow_index'): 6,
+        }
+        for url, queries in expected.items():
+            with self.subTest(url=url):
+                # Первый запрос заводит счетчики лент
+                self.client.get(url)
+                cache.clear()
+                with self.assertNumQueries(queries):
+                    self.client.get(url)
+
+    def test_feed_queries_use_indexes(self):
+        """Posts: Запросы лент читаются по индексам без сортировки."""
+        out = StringIO()
+        call_command('explain_feeds', stdout=out)
+        self.assertNotIn('FAIL', out.getvalue())
+
+    @override_settings(CELEBRITY_FOLLOWERS=1)
+    def test_explain_merged_follow_feed(self):
+        """
+        Posts: Для читателя популярного автора отчет показывает
+        оба запроса ленты подписок.
+        """
+        fan = User.objects.create(username='fan')
+        Follow.objects.create(
+            user=fan, author=User.objects.get(username='author_0')
+        )
+        out = StringIO()
+        call_command('explain_feeds', user=fan.username, stdout=out)
+        self.assertIn('follow_index pushed', out.getvalue())
+        self.assertIn('follow_index celebrities', out.getvalue())
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='etag_author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='etag_group', description='Описание'
+        )
+        cls.post = Post.objects.create(
+            text='Пост', author=cls.author, group=cls.group
+        )
+
+    def setUp(self):
+        self.client = Client()
+
+    def test_not_modified(self):
+        """
+        Posts: Совпавший ETag дает 304 без запроса ленты,
+        новый пост или комментарий меняет ETag.
+        """
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse(
+                'posts:profile', kwargs={'username': self.author.username}
+            ),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+        user_client = Client()
+        user_client.force_login(self.author)
+        for url in urls:
+            with self.subTest(url=url):
+                # Анонимному читателю отвечает кэш страниц, без базы.
+                # Профиль целиком не кэшируется, его ETag — один запрос
+                tag = self.client.get(url)['ETag']
+                queries = 1 if url == urls[2] else 0
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=tag)
+                self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+                # Первый ответ ставит CSRF-куку, от которой зависит ETag
+                user_client.get(url)
+                user_tag = user_client.get(url)['ETag']
+                response = user_client.get(url, HTTP_IF_NONE_MATCH=user_tag)
+                self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+                other_page = self.client.get(
+                    url, {'page': 2}, HTTP_IF_NONE_MATCH=tag
+                )
+                self.assertEqual(other_page.status_code, HTTPStatus.OK)
+
+        tags = {url: self.client.get(url)['ETag'] for url in urls}
+        Post.objects.create(
+            text='Новый', author=self.author, group=self.group
+        )
+        Comment.objects.create(post=self.post, author=self.author, text='!')
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=tags[url])
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_author_and_group_change_etag(self):
+        """
+        Posts: Смена имени автора и адреса группы меняет ETag лент
+        и страницы поста.
+        """
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+        tags = {url: self.client.get(url)['ETag'] for url in urls}
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name = 'Переименован'
+        author.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=tags[url])
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+        url = urls[2]
+        tag = self.client.get(url)['ETag']
+        group = Group.objects.get(pk=self.group.pk)
+        group.slug = 'etag_moved'
+        group.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
@@ -0,0 +1,358 @@
+"""
+Миниатюры постов строятся заранее, а не при первом показе.
+
+После сохранения поста с картинкой все размеры из SIZES, адаптивные
+варианты и заглушка (posts.images) ставятся в очередь пула процессов.
+Шаблоны берут миниатюру только если она уже есть в KV-хранилище sorl
+и до тех пор показывают оригинал, поэтому запрос никогда не ждет
+Pillow.
+"""
+import logging
+import os
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from sorl.thumbnail import base, default
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize, serialize
+from sorl.thumbnail.images import (
+    ImageFile, deserialize_image_file, serialize_image_file
+)
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.workers import process_pool
+
+from . import images
+from .storage import image_storage
+
+logger = logging.getLogger(__name__)
+
+# Размеры, которые выводят шаблоны: геометрия и параметры sorl
+SIZES = {
+    '960x339': {'crop': 'center', 'upscale': True},
+}
+QUEUED_TIMEOUT = 60
+
+
+class ThumbnailBackend(base.ThumbnailBackend):
+    """Бэкенд sorl, который умеет искать миниатюру без генерации."""
+
+    def thumbnail_options(self, source, options):
+        """Параметры с умолчаниями, как их дополняет get_thumbnail()."""
+        options = dict(options)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        """Файл миниатюры, как его назвал бы get_thumbnail()."""
+        source = ImageFile(file_)
+        options = self.thumbnail_options(source, options)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def lookup(self, file_, geometry_string, **options):
+        """Готовая миниатюра из KV-хранилища или None."""
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options)
+        )
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """KV-хранилище sorl, которое читает записи пачкой."""
+
+    def get_many(self, image_files):
+        """
+        {ключ картинки: ImageFile или None} за один get_many кэша
+        и не больше чем один запрос к базе на все промахи.
+        """
+        keys = {add_prefix(image.key): image.key for image in image_files}
+        values = self.cache.get_many(list(keys))
+        missing = [key for key in keys if key not in values]
+        if missing:
+            found = dict(
+                KVStoreModel.objects.filter(key__in=missing)
+                .values_list('key', 'value')
+            )
+            # Отсутствие тоже кэшируется, как в _get_raw()
+            fill = {
+                key: found.get(key, cached_db_kvstore.EMPTY_VALUE)
+                for key in missing
+            }
+            self.cache.set_many(
+                fill, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+            )
+            values.update(fill)
+        return {
+            keys[key]: (
+                None if value == cached_db_kvstore.EMPTY_VALUE
+                else deserialize_image_file(value)
+            )
+            for key, value in values.items()
+        }
+
+    def set_many(self, entries):
+        """
+        Записывает исходники и их миниатюры пачкой: [(исходник,
+        [миниатюры]), ...]. Вместо пары запросов на каждую запись
+        set() — одно чтение списков миниатюр, удаление и bulk_create.
+        """
+        values = {}
+        lists = {add_prefix(source.key, 'thumbnails'): (source, thumbnails)
+                 for source, thumbnails in entries}
+        existing = dict(
+            KVStoreModel.objects.filter(key__in=list(lists))
+            .values_list('key', 'value')
+        )
+        for key, (source, thumbnails) in lists.items():
+            values[add_prefix(source.key)] = serialize_image_file(source)
+            for thumbnail in thumbnails:
+                values[add_prefix(thumbnail.key)] = serialize_image_file(
+                    thumbnail
+                )
+            # Миниатюры прежних размеров остаются в списке исходника,
+            # чтобы их файлы удалялись вместе с ним
+            keys = set(deserialize(existing.get(key, '[]')))
+            keys.update(thumbnail.key for thumbnail in thumbnails)
+            values[key] = serialize(sorted(keys))
+        with transaction.atomic():
+            KVStoreModel.objects.filter(key__in=list(values)).delete()
+            KVStoreModel.objects.bulk_create(
+                KVStoreModel(key=key, value=value)
+                for key, value in values.items()
+            )
+        self.cache.set_many(values, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+
+
+# Миниатюры, найденные за текущий запрос: (имя картинки, геометрия)
+_memo = threading.local()
+
+
+def _request_memo():
+    if not hasattr(_memo, 'thumbnails'):
+        _memo.thumbnails = {}
+    return _memo.thumbnails
+
+
+def reset_memo(**kwargs):
+    _memo.thumbnails = {}
+
+
+def prefetch(images):
+    """
+    Ищет миниатюры всех размеров для картинок страницы одним
+    обращением к KV-хранилищу и запоминает их до конца запроса.
+    """
+    files = {
+        (image.name, geometry): default.backend.thumbnail_file(
+            image, geometry, **options
+        )
+        for image in images if image
+        for geometry, options in SIZES.items()
+    }
+    if not files:
+        return
+    found = default.kvstore.get_many(files.values())
+    memo = _request_memo()
+    for key, thumbnail in files.items():
+        memo[key] = found.get(thumbnail.key)
+
+
+def build_variants(name):
+    """Манифест адаптивных вариантов картинки, см. posts.images."""
+    from .models import Post
+
+    image_hash = Post.objects.filter(image=name).exclude(
+        image_hash=''
+    ).values_list('image_hash', flat=True).first()
+    with image_storage.open(name) as file:
+        if not image_hash:
+            image_hash = images.file_hash(file)[0]
+        return images.build_variants(file, image_hash)
+
+
+def build_placeholder(name):
+    """Заглушка картинки из хранилища, см. posts.images.placeholder."""
+    with image_storage.open(name) as file:
+        return images.placeholder(file)
+
+
+def generate(name):
+    """
+    Строит все размеры, адаптивные варианты и заглушку картинки;
+    выполняется в пуле. Затем сбрасывает закэшированные страницы,
+    где вместо миниатюры пока стоит оригинал.
+    """
+    from . import cards, fragments
+    from .models import Post
+
+    # Ключ миниатюры в sorl включает хранилище исходника
+    source = ImageFile(name, image_storage)
+    for geometry, options in SIZES.items():
+        default.backend.get_thumbnail(source, geometry, **options)
+        _request_memo().pop((name, geometry), None)
+    posts = Post.objects.filter(image=name)
+    pending = list(
+        posts.filter(Q(image_variants='') | Q(image_placeholder=''))
+        .only('pk', 'updated', 'author_id', 'group_id')
+    )
+    if not pending:
+        return
+    # Одинаковые загрузки делят файл (posts.storage), поэтому
+    # варианты и заглушку могли уже построить для другого поста
+    variants = posts.exclude(image_variants='').values_list(
+        'image_variants', flat=True
+    ).first() or images.dump_manifest(build_variants(name))
+    placeholder = posts.exclude(image_placeholder='').values_list(
+        'image_placeholder', flat=True
+    ).first() or build_placeholder(name)
+    posts.filter(pk__in=[post.pk for post in pending]).update(
+        image_variants=variants, image_placeholder=placeholder
+    )
+    # Остальные посты с этим файлом уже показывают варианты
+    for post in pending:
+        cards.purge_cards([(post.pk, post.updated)])
+        fragments.bump_post(post)
+
+
+def render(source, force=False):
+    """
+    Строит недостающие миниатюры SIZES для исходника, не трогая
+    KV-хранилище. Картинка декодируется один раз и только если
+    какой-то миниатюры нет. Возвращает все миниатюры и созданные.
+    """
+    source_image = None
+    thumbnails = []
+    created = []
+    for geometry, options in SIZES.items():
+        options = default.backend.thumbnail_options(source, options)
+        thumbnail = ImageFile(
+            default.backend._get_thumbnail_filename(
+                source, geometry, options
+            ),
+            default.storage
+        )
+        if force or not thumbnail.exists():
+            if source_image is None:
+                source_image = default.engine.get_image(source)
+                source.set_size(default.engine.get_image_size(source_image))
+            options['image_info'] = default.engine.get_image_info(
+                source_image
+            )
+            default.backend._create_thumbnail(
+                source_image, geometry, options, thumbnail
+            )
+            created.append(thumbnail)
+        thumbnails.append(thumbnail)
+    return thumbnails, created
+
+
+def rebuild(name, force=False):
+    """
+    Выполняется в пуле rebuild_thumbnails. Возвращает исходник и его
+    миниатюры в виде строк KV-хранилища, число созданных миниатюр
+    и прочитанные и записанные байты, или None, если файла нет.
+    """
+    source = ImageFile(name, image_storage)
+    try:
+        thumbnails, created = render(source, force)
+        for image_file in (source, *thumbnails):
+            if image_file.size is None:
+                image_file.set_size()
+    except OSError:
+        logger.warning('Не удалось построить миниатюры %s', name)
+        return None
+    # Исходник читается целиком, только если что-то пришлось строить
+    io_bytes = sum(
+        image_file.storage.size(image_file.name)
+        for image_file in ([source, *created] if created else [])
+    )
+    return (
+        serialize_image_file(source),
+        [serialize_image_file(thumbnail) for thumbnail in thumbnails],
+        len(created),
+        io_bytes,
+    )
+
+
+_executor = None
+_executor_pid = None
+
+
+def _get_executor():
+    # Пул создается в каждом воркере сервера отдельно
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = process_pool(settings.THUMBNAIL_WORKERS)
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _log_failure(name, future):
+    # Иначе исключение из пула пропало бы вместе с Future
+    if not future.cancelled() and future.exception() is not None:
+        logger.error('Не удалось построить миниатюры %s', name,
+                     exc_info=future.exception())
+
+
+def _submit(name):
+    if not settings.THUMBNAIL_WORKERS:
+        try:
+            generate(name)
+        except Exception:
+            logger.exception('Не удалось построить миниатюры %s', name)
+        return
+    global _executor
+    try:
+        future = _get_executor().submit(generate, name)
+        future.add_done_callback(partial(_log_failure, name))
+    except Exception:
+        # Сломанный пул не должен ронять запрос: страница покажет
+        # оригинал, а следующая постановка создаст пул заново
+        logger.exception('Не удалось поставить миниатюры %s в очередь', name)
+        _executor = None
+
+
+def enqueue(name):
+    """
+    Ставит генерацию миниатюр в очередь после фиксации транзакции.
+    Повторные вызовы для той же картинки в течение QUEUED_TIMEOUT
+    ничего не делают.
+    """
+    if not name or not cache.add(f'thumbnail_queued:{name}', 1,
+                                 QUEUED_TIMEOUT):
+        return
+    transaction.on_commit(lambda: _submit(name))
+
+
+def ready(image, geometry_string):
+    """
+    Готовая миниатюра размера из SIZES или None. Если ее нет,
+    генерация ставится в очередь, а шаблон пока показывает оригинал.
+    """
+    if not image:
+        return None
+    memo = _request_memo()
+    key = (image.name, geometry_string)
+    if key in memo:
+        thumbnail = memo[key]
+    else:
+        thumbnail = memo[key] = default.backend.lookup(
+            image, geometry_string, **SIZES[geometry_string]
+        )
+    if thumbnail is None:
+        enqueue(image.name)
+    return thumbnail
@@ -0,0 +1,279 @@
+import heapq
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F
+
+from core.invalidation import purge
+
+from . import counters
+from .models import AuthorStats, Follow, Post, TimelineEntry
+
+BATCH_SIZE = 500
+CELEBRITIES_TIMEOUT = 60
+
+
+def followers_count(author_id):
+    return Follow.objects.filter(author_id=author_id).count()
+
+
+def is_celebrity(author_id):
+    """
+    Посты популярных авторов не раскладываются по лентам:
+    это слишком много строк на одну публикацию.
+    """
+    return AuthorStats.objects.filter(
+        user_id=author_id, feed_mode=AuthorStats.PULLED
+    ).exists()
+
+
+def push_post(post):
+    """Раскладывает новый пост по лентам всех подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post.pk,
+                       pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту читателя все посты автора после подписки."""
+    if is_celebrity(author_id):
+        return
+    posts = Post.objects.filter(
+        author_id=author_id
+    ).values_list('pk', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты читателя посты автора после отписки."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def follow_changed(author_id):
+    """
+    Делает автора популярным, когда подписка довела число подписчиков
+    до CELEBRITY_FOLLOWERS. Обратно его переводит команда
+    classify_celebrities, и только когда подписчиков станет меньше
+    CELEBRITY_DEMOTE_FOLLOWERS: отписка ничего не раскладывает,
+    а автор у порога не переключается туда и обратно.
+    """
+    if followers_count(author_id) >= settings.CELEBRITY_FOLLOWERS:
+        promote([author_id])
+
+
+def promote(author_ids):
+    """
+    Переводит авторов на подтягивание постов при чтении. Уже
+    разложенные записи остаются в лентах: MergedFeed отбрасывает
+    повторы. Возвращает число переведенных авторов.
+    """
+    author_ids = set(author_ids)
+    if not author_ids:
+        return 0
+    stats = AuthorStats.objects.filter(user_id__in=author_ids)
+    missing = author_ids - set(stats.values_list('user_id', flat=True))
+    if missing:
+        counters.create_author_stats(missing)
+    promoted = stats.exclude(feed_mode=AuthorStats.PULLED).update(
+        feed_mode=AuthorStats.PULLED
+    )
+    if promoted:
+        purge([celebrities_key()])
+    return promoted
+
+
+def demote(author_id):
+    """
+    Раскладывает посты автора по лентам всех подписчиков и переводит
+    его обратно на раскладку; выполняется командой classify_celebrities.
+    Пока идет раскладка, новые посты и подписки уже раскладываются,
+    а чтение все еще подтягивает его посты, так что из лент ничего
+    не пропадает. Возвращает False, если автор успел снова стать
+    популярным.
+    """
+    stats = AuthorStats.objects.filter(user_id=author_id)
+    if not stats.exclude(feed_mode=AuthorStats.PUSHED).update(
+        feed_mode=AuthorStats.DEMOTING
+    ):
+        return False
+    followers = list(
+        Follow.objects.filter(author_id=author_id)
+        .values_list('user_id', flat=True)
+    )
+    for follower_id in followers:
+        backfill(follower_id, author_id)
+    demoted = stats.filter(feed_mode=AuthorStats.DEMOTING).update(
+        feed_mode=AuthorStats.PUSHED
+    )
+    purge([celebrities_key()])
+    return bool(demoted)
+
+
+def popular_authors():
+    """id авторов, у которых не меньше CELEBRITY_FOLLOWERS подписчиков."""
+    return list(
+        Follow.objects.order_by().values('author_id')
+        .annotate(followers=Count('pk'))
+        .filter(followers__gte=settings.CELEBRITY_FOLLOWERS)
+        .values_list('author_id', flat=True)
+    )
+
+
+def fading_celebrities():
+    """
+    id популярных авторов, у которых подписчиков стало меньше
+    CELEBRITY_DEMOTE_FOLLOWERS.
+    """
+    return list(
+        AuthorStats.objects.exclude(feed_mode=AuthorStats.PUSHED)
+        .annotate(followers=Count('user__following'))
+        .filter(followers__lt=settings.CELEBRITY_DEMOTE_FOLLOWERS)
+        .values_list('user_id', flat=True)
+    )
+
+
+def celebrities_key():
+    return 'celebrities'
+
+
+def celebrities():
+    """
+    id авторов, чьи посты подтягиваются при чтении, в том числе
+    переводимых в раскладку. Список короткий и меняется редко,
+    поэтому держим его в кэше.
+    """
+    authors = cache.get(celebrities_key())
+    if authors is None:
+        authors = list(
+            AuthorStats.objects.exclude(feed_mode=AuthorStats.PUSHED)
+            .values_list('user_id', flat=True)
+        )
+        cache.set(celebrities_key(), authors, CELEBRITIES_TIMEOUT)
+    return authors
+
+
+def followed_celebrities(user):
+    """id популярных авторов, на которых подписан пользователь."""
+    authors = celebrities()
+    if not authors:
+        return []
+    return list(
+        user.follower.filter(author_id__in=authors)
+        .values_list('author_id', flat=True)
+    )
+
+
+class MergedFeed:
+    """
+    Лента из нескольких отсортированных источников: записи из
+    TimelineEntry плюс посты популярных авторов.
+    Срез собирается k-way слиянием, повторы по id отбрасываются.
+    Поддерживает ровно то, что нужно CursorPaginator:
+    order_by(), filter(), reverse() и срезы.
+    """
+
+    ordered = True
+
+    def __init__(self, sources, descending=True):
+        self.sources = sources
+        self.descending = descending
+
+    def _clone(self, method, *args, **kwargs):
+        return MergedFeed(
+            [getattr(source, method)(*args, **kwargs)
+             for source in self.sources],
+            self.descending
+        )
+
+    def order_by(self, *fields):
+        return self._clone('order_by', *fields)
+
+    def filter(self, *args, **kwargs):
+        return self._clone('filter', *args, **kwargs)
+
+    def reverse(self):
+        feed = self._clone('reverse')
+        feed.descending = not self.descending
+        return feed
+
+    def count(self):
+        return sum(source.count() for source in self.sources)
+
+    def __len__(self):
+        return len(self[:])
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        sources = self.sources
+        if key.stop is not None:
+            sources = [source[:key.stop] for source in sources]
+        merged = heapq.merge(
+            *sources,
+            key=lambda post: (post.pub_date, post.pk),
+            reverse=self.descending
+        )
+        posts = []
+        seen = set()
+        for post in merged:
+            if post.pk in seen:
+                continue
+            seen.add(post.pk)
+            posts.append(post)
+            if key.stop is not None and len(posts) >= key.stop:
+                break
+        return posts[start:]
+
+
+def pushed_posts(user, posts):
+    """Посты обычных авторов, заранее разложенные по ленте читателя."""
+    return posts.filter(timeline_entries__user=user).annotate(
+        feed_date=F('timeline_entries__pub_date'),
+        feed_pk=F('timeline_entries__post_id')
+    )
+
+
+def pulled_posts(posts, authors):
+    """Посты популярных авторов, которые подтягиваются при чтении."""
+    return posts.filter(author_id__in=authors).annotate(
+        feed_date=F('pub_date'),
+        feed_pk=F('pk')
+    )
+
+
+def follow_feed(user, posts=None):
+    """
+    Лента подписок: разложенные заранее посты обычных авторов
+    и посты популярных авторов, которые подтягиваются при чтении.
+    Популярные авторы читаются одним запросом, а не запросом на автора:
+    на графе с перекосом читатель подписан на многих из них.
+    Оба источника сортируются по полям feed_date и feed_pk,
+    которые для разложенных постов берутся из индекса TimelineEntry.
+    """
+    if posts is None:
+        posts = Post.objects.all()
+    pushed = pushed_posts(user, posts)
+    authors = followed_celebrities(user)
+    if not authors:
+        return pushed
+    return MergedFeed([pushed, pulled_posts(posts, authors)])
@@ -1,46 +1,69 @@
+from functools import partial
+
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
+from django.views.decorators.http import etag
+
+from core import page_cache
 
-from .models import Comment, Follow, Group, Post, User
+from .models import Follow, Group, Post, User
+from . import conditional, counters, fragments, thumbnails, timeline
+from .feeds import feed_posts
 from .forms import CommentForm, PostForm
+from .paginators import (CommentPaginator, CursorPaginator, InvalidCursor,
+                         TimelinePaginator)
 
 POSTS: int = 10
+COMMENTS: int = 10
 
 
-def paginator(request, posts):
+def paginator(request, posts, count_provider=None,
+              paginator_class=CursorPaginator):
 
-    paginator = Paginator(posts, POSTS)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = paginator_class(posts, POSTS, count_provider=count_provider)
+    page_obj = paginator.get_page_from_request(request)
     return page_obj
 
 
+@etag(conditional.index_etag)
 def index(request):
-    posts = Post.objects.select_related('group')
-    page_obj = paginator(request, posts)
+    posts = feed_posts()
+    page_obj = paginator(request, posts, counters.index_count)
     context = {
         'page_obj': page_obj,
+        **fragments.feed_cache_context(request, fragments.INDEX),
     }
-    return render(request, 'posts/index.html', context)
+    return page_cache.tag(
+        render(request, 'posts/index.html', context), fragments.INDEX
+    )
 
 
+@etag(conditional.group_etag)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.select_related('group')
-    page_obj = paginator(request, posts)
+    posts = feed_posts(group.posts.all())
+    page_obj = paginator(
+        request, posts, partial(counters.group_count, group)
+    )
     context = {
         'group': group,
         'page_obj': page_obj,
+        **fragments.feed_cache_context(
+            request, fragments.group_feed(group.pk)
+        ),
     }
-    return render(request, 'posts/group_list.html', context)
+    return page_cache.tag(
+        render(request, 'posts/group_list.html', context),
+        fragments.group_tag(group.pk)
+    )
 
 
+@etag(conditional.profile_etag)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    posts = author.posts.select_related('author')
-    count = posts.count()
-    page_obj = paginator(request, posts)
+    posts = feed_posts(author.posts.all())
+    count = counters.author_count(author)
+    page_obj = paginator(request, posts, lambda: count)
     following = (request.user.is_authenticated
                  and author.following.filter(user=request.user).exists())
     context = {
@@ -53,10 +76,24 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+def comments_page(request, post):
+    comments = CommentPaginator(
+        post.comments.select_related('author'), COMMENTS
+    )
+    after = request.GET.get('after')
+    if after:
+        try:
+            return comments.page_after(after)
+        except InvalidCursor:
+            pass
+    return comments.first_page()
+
+
+@etag(conditional.post_etag)
 def post_detail(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
-    count = post.author.posts.count()
-    comments = Comment.objects.select_related('post')
+    count = counters.author_count(post.author)
+    comments = comments_page(request, post)
     form = CommentForm(request.POST or None)
     context = {
         'post': post,
@@ -64,7 +101,20 @@ def post_detail(request, post_id):
         'comments': comments,
         'form': form,
     }
-    return render(request, 'posts/post_detail.html', context)
+    return page_cache.tag(
+        render(request, 'posts/post_detail.html', context),
+        *fragments.page_tags(post)
+    )
+
+
+def post_comments(request, post_id):
+    # Следующая пачка комментариев без остальной страницы поста
+    post = get_object_or_404(Post, pk=post_id)
+    context = {
+        'post': post,
+        'comments': comments_page(request, post),
+    }
+    return render(request, 'posts/includes/comments.html', context)
 
 
 @login_required
@@ -75,6 +125,7 @@ def post_create(request):
             post = form.save(commit=False)
             post.author = request.user
             post.save()
+            thumbnails.enqueue(post.image.name)
             return redirect('posts:profile', request.user)
         return render(
             request,
@@ -102,6 +153,8 @@ def post_edit(request, post_id):
         if request.method == 'POST' or None:
             if form.is_valid():
                 form.save()
+                if 'image' in form.changed_data:
+                    thumbnails.enqueue(post.image.name)
                 return redirect('posts:post_detail', post_id)
             return render(
                 request,
@@ -130,12 +183,22 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    # Post.objects.filter(author__follower__user=request.user) слишком
-    # тяжело далось, теория и ТЗ как будто вообще на это не наводят((.
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginator(request, posts)
+    # Посты обычных авторов заранее разложены по лентам читателей
+    # (TimelineEntry), посты популярных авторов подмешиваются при чтении.
+    posts = timeline.follow_feed(request.user, feed_posts())
+    author_ids = counters.followed_authors(request.user)
+    page_obj = paginator(
+        request,
+        posts,
+        partial(counters.follow_count, request.user, author_ids),
+        TimelinePaginator
+    )
     context = {
         'page_obj': page_obj,
+        **fragments.feed_cache_context(
+            request, fragments.follow_feed(request.user.pk),
+            fragments.follow_feed_version(request.user.pk, author_ids)
+        ),
     }
     return render(request, 'posts/follow.html', context)
 
@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.page_cache.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -145,8 +146,69 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузки пишутся во временный файл и обрываются после
+# FILE_UPLOAD_MAX_SIZE байт (core.uploads). Картинки постов проверяются
+# по заголовку, без декодирования: не больше IMAGE_MAX_PIXELS пикселей.
+FILE_UPLOAD_HANDLERS = ['core.uploads.BoundedUploadHandler']
+FILE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+
+# Общий для всех воркеров на машине кэш в mmap-файле (core.mmap_cache):
+# сброс фрагмента в одном процессе сразу виден остальным. Каталог
+# создается с правами 0o700 и должен принадлежать пользователю сервера.
+# Классы ячеек по размерам значений: поколения, токены тегов, блокировки
+# и записи sorl занимают до сотни байт, карточка поста — около 1,5 КиБ,
+# страница ленты и ее фрагмент — 5–20 КиБ. Файл занимает 72 МиБ
+# и заполняется по мере записи.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.mmap_cache.MmapCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'yatube_cache'),
+        'OPTIONS': {
+            'SLOT_CLASSES': {
+                512: 16384,
+                2 * 1024: 8192,
+                32 * 1024: 1024,
+                128 * 1024: 128,
+            },
+        },
     }
 }
+
+# Сколько секунд хранятся страницы для анонимных читателей
+# (core.page_cache). 0 выключает кэш страниц.
+PAGE_CACHE_TIMEOUT = 60 * 5
+
+# Миниатюры строятся пулом процессов после загрузки (posts.thumbnails).
+# 0 — строить сразу в процессе сервера.
+THUMBNAIL_BACKEND = 'posts.thumbnails.ThumbnailBackend'
+THUMBNAIL_KVSTORE = 'posts.thumbnails.KVStore'
+THUMBNAIL_WORKERS = 2
+
+# Шина сброса кэша между узлами (core.invalidation). Пример:
+# INVALIDATION_BUS = {
+#     'TRANSPORT': 'core.invalidation.UDPTransport',
+#     'NODE': 'web-1',
+#     'OPTIONS': {'bind': ('0.0.0.0', 9955),
+#                 'peers': [('10.0.0.2', 9955), ('10.0.0.3', 9955)]},
+# }
+# None — кэш сбрасывается только на своем узле.
+INVALIDATION_BUS = None
+
+# Посты авторов, у которых подписчиков не меньше этого числа,
+# не раскладываются по лентам читателей, а подмешиваются при чтении
+# ленты подписок. Обратно на раскладку автор переводится командой
+# classify_celebrities, когда подписчиков стало меньше
+# CELEBRITY_DEMOTE_FOLLOWERS: зазор не дает автору у порога
+# переключаться при каждой подписке и отписке.
+CELEBRITY_FOLLOWERS = 1000
+CELEBRITY_DEMOTE_FOLLOWERS = 900
+
+# Время жизни закэшированных страниц лент. Страницы сбрасываются
+# сигналами при изменении постов и комментариев, поэтому оно может быть
+# заметно больше прежних 20 секунд.
+FEED_CACHE_TIMEOUT = 60 * 15
+
+# Тесты запускаются со своим кэшем во временном каталоге, см.
+# core.test_runner.
+TEST_RUNNER = 'core.test_runner.CacheIsolatingRunner'